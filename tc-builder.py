@@ -16,7 +16,7 @@ Unlike Zeranoe's build script, wget, git, subversion, etc. are not needed
 since this script only utilize FTP and HTTP through Python's built-in
 networking functions.
 
-Download is parallelized with 2 threads by default.
+Download is parallelized with 4 threads by default.
 
 The building is complicated with some steps of uncertain function.
 Roughly speaking, the build order (corresponds to functions order):
@@ -38,26 +38,48 @@ The CRT build script is relatively dumb and need to set
 CC variable to the the mingw compiler in order to work.
 """
 import os
-import stat
 import re
 import tarfile
+import gzip
+import bz2
+import lzma
+import io
 import ftplib
-import multiprocessing as mp
 import subprocess
+import errno
 import argparse
 import hashlib
 import datetime
 import time
 import socket
+import functools
+import contextlib
+import threading
+import posixpath
+import glob
+import itertools
+import asyncio
 from ftplib import FTP
-from urllib import request, response
 from urllib.parse import urljoin, urlparse
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
-from bs4 import BeautifulSoup
-from shutil import rmtree, move
+import codecs
+from html.parser import HTMLParser
+from shutil import move, copyfileobj, which
 from colorama import init, Fore, Back, Style, deinit
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+try:  # faster hashes for the extraction stamps, MD5 is used without them
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 # Constants
 WORK_FOLDER = "~/MWTC/"
@@ -150,6 +172,10 @@ FOLDER_PATTERNS = {
     "cloog": None
 }
 
+COMPILED_FILENAME_PATTERNS = {key: re.compile(value) for key, value in FILENAME_PATTERNS.items()}
+
+COMPILED_FOLDER_PATTERNS = {key: re.compile(value) if value else None for key, value in FOLDER_PATTERNS.items()}
+
 FOLDER_VERSION_CAPTURE = {
     "gcc": 1,
     "binutils": 1,
@@ -194,6 +220,12 @@ SAVE_PATH = {
     "pkgconf": "./dl/pkgconf.tar.gz"
 }
 
+EXTRACT_EXCLUDE = {  # folders inside a tarball (below its top folder) that the build never reads
+    "binutils": ("binutils/testsuite/", "gas/testsuite/", "ld/testsuite/"),
+    "gcc": ("gcc/testsuite/", "gcc/ada/", "gcc/d/", "gcc/fortran/", "gcc/go/",
+            "libada/", "libgfortran/", "libgo/", "libjava/", "libphobos/")  # only C and C++ are built
+}
+
 LOCATIONS = {
     "pkg_dir": "./pkgs/",
     "mingw_w64_i686_prefix": "./mingw-w64-i686/",
@@ -207,10 +239,94 @@ TARGET = {
     "x86_64": "x86_64-w64-mingw32"
 }
 
+PREFIXES = {}  # absolute install prefix of each architecture in TARGET, see resolve_locations()
+PREFIX_BINS = {}  # and its bin folder
+
 USE_SJLJ = False
 
+USE_TMPFS = False  # build in RAM when TMPFS_FOLDER has room, see tmpfs_build_folder()
+TMPFS_FOLDER = "/dev/shm"
+TMPFS_MIN_FREE = 16 << 30  # bytes that have to be free on TMPFS_FOLDER, two GCC build trees take most of it
+
+MACHINE = os.uname().machine  # host architecture, used to name the host library prefixes
+
+CCACHE = which("ccache")  # compilers are wrapped in ccache when it is installed, see with_ccache()
+
+IS_CI = bool(os.environ.get("CI"))  # build logs are copied to stdout on CI, see run_logged()
+ORIGINAL_PATH = os.environ["PATH"]  # PATH before any toolchain is added, read once at start
+
+# GMP, MPFR, ISL, CLoog and MPC run inside the compiler, not in what it produces, so they do not depend
+# on the cross target. They are built once under pkg_dir/<name>/<name>-MACHINE and the i686 and x86_64
+# GCC builds are both configured against the same prefixes.
+HOST_LIBRARY_NAMES = {  # libraries built with the host compiler for GCC, and their names in messages
+    "gmp": "GMP",
+    "mpfr": "MPFR",
+    "isl": "ISL",
+    "cloog": "CLoog",
+    "mpc": "MPC"
+}
+
+HOST_LIBRARY_ARGS = {  # configure arguments, after --build, --prefix and the dependency locations
+    "gmp": ["--enable-fat", "--disable-shared", "--enable-static", "--enable-cxx", "CPPFLAGS=-fexceptions"],
+    "mpfr": ["--disable-shared", "--enable-static"],
+    "isl": ["--disable-shared", "--enable-static", "--with-piplib=no", "--with-clang=no"],
+    "cloog": ["--disable-shared", "--enable-static", "--with-bits=gmp", "--with-isl=bundled"],
+    "mpc": ["--disable-shared", "--enable-static"]
+}
+
+HOST_PREFIXES = {}  # install prefixes of the host libraries built in this run, see build_host_library()
+
 PERFORMANCE_COUNTER = {}
 
+_ftp_local = threading.local()  # per thread FTP connections, see ftp_session()
+_ftp_sessions = []  # every connection opened by ftp_session(), for closing at the end
+_ftp_sessions_lock = threading.Lock()
+_listing_cache = {}  # (server, folder): directory listing, see ftp_list()
+_listing_cache_lock = threading.Lock()
+_http = requests.Session()  # keeps connections alive between the release page and the tarball
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+HASH_BUFFER_SIZE = 1 << 20  # read size when hashing tarballs
+
+DOWNLOAD_WORKERS = 4  # concurrent downloads, kept low out of courtesy to the servers
+DOWNLOADS_PER_SERVER = 2  # and from any one server, see download_all()
+
+SEGMENT_COUNT = 4  # connections used for one large FTP download
+SEGMENT_MIN_SIZE = 8 << 20  # smaller files are not worth the extra log-ins
+SEGMENT_BLOCK_SIZE = 1 << 16
+FTP_BLOCK_SIZE = 1 << 18  # bytes read from the data connection per retrbinary callback
+DOWNLOAD_BUFFER_SIZE = 2 << 20  # write buffer for downloaded files
+
+HTML_CHUNK_SIZE = 1 << 16  # bytes fed to the link parser at a time
+COPY_BUFFER_SIZE = 4 << 20  # copyfileobj length for HTTP downloads, the default is 64 KiB
+
+BUILD_STEP_VERBS = {"configure": "Configuring", "build": "Building", "install": "Installing"}
+
+LOG_BUFFER_SIZE = 1 << 16  # build log writes, and reads when copying the log to stdout on CI
+
+TAR_BUFFER_SIZE = 2 << 20  # read buffer between the decompressor and tarfile
+
+TAR_STREAM_MODES = {  # tarfile modes for extracting from a non-seekable pipe
+    ".gz": "r|gz",
+    ".bz2": "r|bz2",
+    ".xz": "r|xz"
+}
+
+TAR_DECOMPRESSORS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open
+}
+
+if sys.stdout.isatty():  # status prefixes are built once, and without colour codes when output is redirected
+    OK_PREFIX = "【" + Fore.GREEN + Style.BRIGHT + "OK" + Fore.RESET + Style.RESET_ALL + "】 "
+    ERROR_PREFIX = "【" + Fore.RED + Back.LIGHTYELLOW_EX + Style.BRIGHT + "ERROR" + Fore.RESET + Style.RESET_ALL + "】 "
+else:
+    OK_PREFIX = "[OK] "
+    ERROR_PREFIX = "[ERROR] "
+_print_lock = threading.Lock()  # keeps status lines from worker threads whole
+
 HELP_TEXT = """\
 {hl}Python(Anaconda) script for building Mingw-w64 cross-toolchain{chl}
 Copyrighted 2017 Maverick Tse YM, Hong Kong
@@ -230,18 +346,20 @@ since this script only utilize FTP and HTTP through Python's built-in
 networking functions. This script also cut down redundant build steps
 in Zeranoe's script when looping.
 
-Download is parallelized with 2 threads by default.
+Download is parallelized with 4 threads by default.
 
 Currently, win32 and win64 toolchains will be built without multilib.
 
 If unspecified, the sandbox will be ~/MWTC by default,
 and latest release versions of each component will be used.
 
-All errors will be logged into files in the component's build folder:
-config_error.log
-build_error.log
-install_error.log
-may be generated with all the details. Console output is kept minimal.
+The output of every step is logged into files in the component's build folder:
+configure.log
+build.log
+install.log
+hold all the details. install.log only keeps the errors of an install,
+not the list of installed files. Console output is kept minimal, unless the CI
+environment variable is set, in which case the logs are copied to it in full.
 
 At the end of the build process, a readme file and 3 shell scripts
 would be generated.
@@ -251,30 +369,170 @@ would be generated.
 # Common functions
 
 
-def print_ok():
-    print("【" + Fore.GREEN + Style.BRIGHT + "OK" + Fore.RESET + Style.RESET_ALL + "】 ", end='')
+def print_line(*message):
+    """
+    print() for worker threads, keeping the line in one piece when threads print at the same time
+    :param message: what to print, as for print()
+    :return: None
+    """
+    with _print_lock:
+        print(*message)
+    return None
+
+
+def print_ok(*message):
+    """
+    Print a status line with the OK prefix, in one piece even when threads print at the same time
+    :param message: what to print after the prefix, as for print()
+    :return: None
+    """
+    with _print_lock:
+        sys.stdout.write(OK_PREFIX)
+        print(*message)
+    return None
+
+
+def print_error(*message):
+    """
+    Print a status line with the ERROR prefix, in one piece even when threads print at the same time
+    :param message: what to print after the prefix, as for print()
+    :return: None
+    """
+    with _print_lock:
+        sys.stdout.write(ERROR_PREFIX)
+        print(*message)
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    """
+    Compile a regex once and reuse it on later calls
+    :param pattern: A regex string or an already compiled pattern
+    :return: The compiled pattern
+    """
+    return re.compile(pattern)
+
+
+def ftp_session(server):
+    """
+    Get a logged in FTP connection to a server. Connections are kept per thread and reused
+    by later downloads from the same server, until close_ftp_sessions() is called.
+    :param server: The ftp server name without sub-directory or protocol name
+    :return: FTP object. None if the connection failed.
+    """
+    sessions = getattr(_ftp_local, "sessions", None)
+    if sessions is None:
+        sessions = _ftp_local.sessions = {}
+    ftp = sessions.get(server)
+    if ftp:
+        try:
+            ftp.voidcmd("NOOP")  # the server may have dropped an idle connection
+            return ftp
+        except ftplib.all_errors:
+            drop_ftp_session(server)
+    ftp = FTP()
+    try:
+        ftp.connect(server, timeout=30)
+        ftp.login()
+    except ftplib.all_errors as e:
+        print('FTP Error: ', str(e))
+        ftp.close()
+        return None
+    sessions[server] = ftp
+    with _ftp_sessions_lock:
+        _ftp_sessions.append(ftp)
+    return ftp
+
+
+def drop_ftp_session(server):
+    """
+    Close and forget this thread's connection to a server, so that the next ftp_session() reconnects
+    :param server: The ftp server name
+    :return: None
+    """
+    sessions = getattr(_ftp_local, "sessions", {})
+    ftp = sessions.pop(server, None)
+    if ftp:
+        with _ftp_sessions_lock:
+            _ftp_sessions.remove(ftp)
+        ftp.close()
     return None
 
 
-def print_error():
-    print("【" + Fore.RED + Back.LIGHTYELLOW_EX + Style.BRIGHT + "ERROR" + Fore.RESET + Style.RESET_ALL + "】 ", end='')
+def close_ftp_sessions():
+    """
+    Log out of every connection opened by ftp_session()
+    :return: None
+    """
+    with _ftp_sessions_lock:
+        for ftp in _ftp_sessions:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+        _ftp_sessions.clear()
     return None
 
 
+def ftp_list(ftp, server, folder):
+    """
+    List the current directory of an FTP connection. Listings are kept for the rest of the run,
+    so packages sharing a folder (e.g. gcc/infrastructure) only list it once.
+    :param ftp: A logged in FTP object, already inside folder
+    :param server: The ftp server name, used with folder as the cache key
+    :param folder: The path of the current directory
+    :return: list of (name, facts). facts is None when the server does not support MLSD.
+    """
+    key = (server, folder)
+    with _listing_cache_lock:
+        listing = _listing_cache.get(key)
+    if listing is not None:
+        return listing
+    try:
+        listing = list(ftp.mlsd(facts=["type", "modify"]))
+    except ftplib.all_errors as e:
+        print("FTP Server does not support MLST/MLSD command! Falling back to NLST")
+        print(str(e))
+        print("Note: No file type or date info available")
+        listing = [(name, None) for name in ftp.nlst()]
+    with _listing_cache_lock:
+        _listing_cache[key] = listing
+    return listing
+
+
+@functools.lru_cache(maxsize=None)
+def version_key(version):
+    """
+    Turn a version string into a tuple of numbers, so that "10.1.0" sorts after "9.4.0"
+    :param version: A dot separated version string
+    :return: tuple of integers
+    """
+    return tuple(int(part) for part in version.split(".") if part.isdigit())
+
+
 def ftp_get(server, folder, filename_re, file_version_capture_group, save_path=None,
             preferred_version="99", folder_re=None, folder_version_capture_group=1,
-            preferred_folder_version="99"):
+            preferred_folder_version="99", extract_folder=None, ftp=None, extract_exclude=(), borrow_slots=None):
     """
     Download a file from FTP server with the preferred version or get the latest
     :param server: The ftp server name without sub-directory or protocol name
     :param folder: The first folder to move to after log in
-    :param filename_re: A regex string that match the full intended filename, with version string in capture group
+    :param filename_re: A regex string or compiled pattern that match the full intended filename, with version string in capture group
     :param file_version_capture_group: Specify which capture group holds the version string. Default=1
     :param save_path: Destination folder or filename for saving the downloaded file
     :param preferred_version: A file with this version string will be downloaded first. If no match, get the latest file
-    :param folder_re: An optional regex for moving to a child folder a second time, basing on version string
+    :param folder_re: An optional regex string or compiled pattern for moving to a child folder a second time, basing on version string
     :param folder_version_capture_group: Specify which capture group in folder_re holds the version string
     :param preferred_folder_version: The preferred version string when moving to a child folder
+    :param extract_folder: When set, a tarball is extracted into this folder while it is being downloaded,
+    or right after the download for files large enough to be fetched in segments.
+    Nothing is extracted if the file already exists.
+    :param ftp: A logged in FTP object to use. If None, the connection kept by ftp_session() is used.
+    :param extract_exclude: Paths not to extract, see tar_members()
+    :param borrow_slots: A function taking the most extra connections a segmented download wants and returning
+    a tuple of (connections granted, function giving them back), to keep within a per-server limit.
+    If None, SEGMENT_COUNT connections are used.
     :return: None if failed. Return the saving path on success
     """
     if not server:
@@ -286,58 +544,40 @@ def ftp_get(server, folder, filename_re, file_version_capture_group, save_path=N
     if file_version_capture_group < 1:
         return None
 
-    ftp = FTP()
-    try:
-        ftp.connect(server, timeout=30)
-        ftp.login()
-    except ftplib.all_errors as e:
-        print('FTP Error: ', str(e))
-        ftp.quit()
+    if not ftp:
+        ftp = ftp_session(server)
+    if not ftp:
         return False
     ftp.cwd(folder)
+    final_folder = folder
 
     if folder_re:  # runs only when there is a regex for folder
-        fre = re.compile(folder_re)
+        fre = compile_pattern(folder_re)
         available_version = {}  # id: version
         folder_data = {}  # id: folder name
         modify_data = {}  # id: last modified date
         keyid = 0
-        try:
-            listing = ftp.mlsd(facts=["type", "modify"])
-            for name, fact in listing:
-                if fact["type"] != "dir":
-                    continue
-                m = fre.fullmatch(name)
-                if not m:
-                    continue
-                available_version[keyid] = m.group(folder_version_capture_group)
-                folder_data[keyid] = name
-                modify_data[keyid] = fact["modify"]
-                keyid += 1
-        except ftplib.all_errors as e:
-            print("FTP Server does not support MLST/MLSD command! Falling back to NLST")
-            print("Note: No file type or date info available")
-            name_list = ftp.nlst()
-            for name in name_list:
-                m = fre.fullmatch(name)
-                if not m:
-                    continue
-                available_version[keyid] = m.group(folder_version_capture_group)
-                folder_data[keyid] = name
-                modify_data[keyid] = keyid
-                keyid += 1
+        for name, fact in ftp_list(ftp, server, folder):
+            if fact and fact["type"] != "dir":
+                continue
+            m = fre.fullmatch(name)
+            if not m:
+                continue
+            available_version[keyid] = m.group(folder_version_capture_group)
+            folder_data[keyid] = name
+            modify_data[keyid] = fact["modify"] if fact else keyid
+            keyid += 1
         # Check for preferred folder version
         foundkey = None
         for key, ver in available_version.items():
             if ver == str(preferred_folder_version):
                 foundkey = key
                 break
-        final_folder = folder
         if foundkey:
             final_folder = urljoin(final_folder, folder_data[foundkey])
         else:  # get latest, default action
             #latestid, stamp = sorted(modify_data.items(), key=itemgetter(1), reverse=False).pop()
-            latestid, stamp = sorted(available_version.items(), key=itemgetter(1), reverse=False).pop()
+            latestid, stamp = max(available_version.items(), key=lambda item: version_key(item[1]))
             final_folder = urljoin(final_folder, folder_data[latestid])
         ftp.cwd(final_folder)  # change to our final target folder
 
@@ -349,30 +589,17 @@ def ftp_get(server, folder, filename_re, file_version_capture_group, save_path=N
     file_names = {}  # id: filename
     file_date = {}  # id: modified date
     keyid = 0
-    fnre = re.compile(filename_re)
-    try:
-        listing = ftp.mlsd(facts=["type", "modify"])
-        for name, fact in listing:
-            if fact["type"] != "file":
-                continue
-            fm = fnre.fullmatch(name)
-            if not fm:
-                continue
-            file_version[keyid] = fm.group(file_version_capture_group)
-            file_names[keyid] = name
-            file_date[keyid] = fact["modify"]
-            keyid += 1
-    except ftplib.all_errors as e:
-        print("No MLST/MLSD support again... falling back")
-        name_list = ftp.nlst()
-        for name in name_list:
-            fm = fnre.fullmatch(name)
-            if not fm:
-                continue
-            file_version[keyid] = fm.group(file_version_capture_group)
-            file_names[keyid] = name
-            file_date[keyid] = keyid
-            keyid += 1
+    fnre = compile_pattern(filename_re)
+    for name, fact in ftp_list(ftp, server, final_folder):
+        if fact and fact["type"] != "file":
+            continue
+        fm = fnre.fullmatch(name)
+        if not fm:
+            continue
+        file_version[keyid] = fm.group(file_version_capture_group)
+        file_names[keyid] = name
+        file_date[keyid] = fact["modify"] if fact else keyid
+        keyid += 1
     # Check for preferred file version
 
     foundkey = None
@@ -385,7 +612,7 @@ def ftp_get(server, folder, filename_re, file_version_capture_group, save_path=N
         final_archive = file_names[foundkey]
     else:
         #latestid, stamp = sorted(file_date.items(), key=itemgetter(1), reverse=False).pop()
-        latestid, stamp = sorted(file_version.items(), key=itemgetter(1), reverse=False).pop()
+        latestid, stamp = max(file_version.items(), key=lambda item: version_key(item[1]))
         final_archive = file_names[latestid]
     # Download file
     # Before downloading, set the save path
@@ -396,8 +623,7 @@ def ftp_get(server, folder, filename_re, file_version_capture_group, save_path=N
         dir_name = os.path.dirname(save_path)  # can be empty
         filename = os.path.basename(save_path)  # can be empty
         if dir_name:
-            if not os.path.exists(dir_name):
-                os.makedirs(dir_name)
+            os.makedirs(dir_name, exist_ok=True)
         if filename:
             final_path = save_path
         else:
@@ -405,27 +631,230 @@ def ftp_get(server, folder, filename_re, file_version_capture_group, save_path=N
         final_path = os.path.abspath(final_path)
     if os.path.exists(final_path):
         print(final_path, "already exists, skipping...")
-        ftp.quit()
+        return final_path
+    # Large archives are fetched over several connections when the server supports SIZE and REST
+    archive_size = None
+    try:
+        ftp.voidcmd("TYPE I")  # SIZE is only reliable in binary mode
+        archive_size = ftp.size(final_archive)
+    except ftplib.all_errors:
+        archive_size = None
+    is_tarball = os.path.splitext(final_archive)[1] in TAR_STREAM_MODES
+    if archive_size and archive_size >= SEGMENT_MIN_SIZE:
+        extra, give_back = borrow_slots(SEGMENT_COUNT - 1) if borrow_slots else (SEGMENT_COUNT - 1, None)
+        try:
+            if extra:
+                # The segments replace our own connection, so the server sees 1 + extra at a time
+                folder = ftp.pwd()
+                drop_ftp_session(server)
+                print("[FTP] Downloading ", final_archive, " to ", final_path, " in ", extra + 1, " segments...")
+                segmented = ftp_get_segmented(server, folder, final_archive, final_path, archive_size, extra + 1)
+                if segmented:
+                    print("[FTP] Download Finished")
+                    if extract_folder and is_tarball:  # segments arrive out of order, so extract from disk
+                        untar(final_path, extract_folder, exclude=extract_exclude)
+                    return final_path
+                print("[FTP] Segmented download failed, falling back to a single stream")
+                ftp = ftp_session(server)
+                if not ftp:
+                    return None
+                ftp.cwd(folder)
+        finally:
+            if give_back:
+                give_back()
+    # Smaller tarballs to be extracted are piped into tarfile as they arrive
+    if extract_folder and is_tarball:
+        print("[FTP] Downloading ", final_archive, " to ", final_path, " and extracting to ", extract_folder, " ...")
+        downloaded = ftp_stream_extract(ftp, final_archive, final_path, extract_folder, extract_exclude)
+        if not downloaded:
+            print("[FTP] Download Failed")
+            drop_ftp_session(server)  # the control connection may be out of step after a failed transfer
+            return None
+        print("[FTP] Download Finished")
         return final_path
     # prepare the file
     retrieve_cmd = "RETR " + final_archive
     print("[FTP] Downloading ", final_archive, " to ", final_path, " ...")
-    ftp.retrbinary(retrieve_cmd, open(final_path, "wb").write)
+    with open(final_path, "wb", buffering=DOWNLOAD_BUFFER_SIZE) as file_handle:
+        ftp.retrbinary(retrieve_cmd, file_handle.write, blocksize=FTP_BLOCK_SIZE)
     print("[FTP] Download Finished")
-    ftp.quit()
     return final_path
 
 
-def select_mirror(server_list=[], priority=1, protocol="FTP", timeout=5.0):
+def ftp_stream_extract(ftp, filename, save_path, destination_folder, exclude=()):
     """
-    Select a server mirror based on connection time
+    Download a tarball and extract it at the same time. The received data is written to save_path,
+    hashed and piped into tarfile in one pass, so the archive is never read back from disk.
+    If only the streamed extraction fails, the saved archive is extracted with untar() instead.
+    :param ftp: A logged in FTP object, already inside the folder holding the file
+    :param filename: Name of the tarball to download
+    :param save_path: Full path for saving the downloaded file
+    :param destination_folder: where to put the extracted files
+    :param exclude: Paths not to extract, see tar_members()
+    :return: True if the tarball was downloaded. False if the download failed.
+    """
+    os.makedirs(destination_folder, exist_ok=True)
+    mode = TAR_STREAM_MODES[os.path.splitext(filename)[1]]
+    hasher = new_cache_hasher()
+    read_fd, write_fd = os.pipe()
+    download_error = []
+
+    def receive():
+        with open(save_path, "wb", buffering=DOWNLOAD_BUFFER_SIZE) as file_handle, \
+                os.fdopen(write_fd, "wb") as pipe:
+            def write(block):
+                file_handle.write(block)
+                hasher.update(block)
+                pipe.write(block)
+            try:
+                ftp.retrbinary("RETR " + filename, write, blocksize=FTP_BLOCK_SIZE)
+            except ftplib.all_errors as e:
+                download_error.append(e)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    extract_ok = False
+    with os.fdopen(read_fd, "rb") as pipe:
+        try:
+            hFile = tarfile.open(fileobj=pipe, mode=mode, bufsize=TAR_BUFFER_SIZE)
+            hFile.extractall(destination_folder, members=tar_members(hFile, exclude))
+            hFile.close()
+            extract_ok = True
+        except (tarfile.TarError, OSError) as e:
+            print("[TAR] Streamed extraction of ", filename, " failed: ", str(e))
+        # Drain whatever tarfile left unread so the download can run to the end
+        while pipe.read(SEGMENT_BLOCK_SIZE):
+            pass
+    receiver.join()
+
+    if download_error:
+        print("[FTP] Error downloading ", filename, ": ", str(download_error[0]))
+        os.remove(save_path)
+        return False
+    if not extract_ok:
+        untar(save_path, destination_folder, exclude=exclude)
+        return True
+    print("[TAR] Extracted ", filename, " to ", destination_folder)
+    write_cache_stamp(save_path, hasher.hexdigest())
+    return True
+
+
+def ftp_get_segmented(server, folder, filename, save_path, file_size, segments=SEGMENT_COUNT):
+    """
+    Download a file over several FTP connections at once, each one fetching a slice of it via REST
+    :param server: The ftp server name without sub-directory or protocol name
+    :param folder: The folder holding the file
+    :param filename: Name of the file to download
+    :param save_path: Full path for saving the downloaded file
+    :param file_size: Size of the file in bytes, as returned by the SIZE command
+    :param segments: Number of parallel connections
+    :return: True on success. False if any segment failed, in which case save_path is removed
+    """
+    step = file_size // segments
+    bounds = []
+    for index in range(segments):
+        start = index * step
+        end = file_size if index == segments - 1 else start + step
+        bounds.append((start, end))
+    fd = os.open(save_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, file_size)
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(ftp_get_segment, server, folder, filename, fd, start, end)
+                       for start, end in bounds]
+            results = [future.result() for future in futures]
+    finally:
+        os.close(fd)
+    if not all(results):
+        os.remove(save_path)
+        return False
+    return True
+
+
+def ftp_get_segment(server, folder, filename, fd, start, end):
+    """
+    Download the byte range [start, end) of a file on its own FTP connection
+    :param server: The ftp server name without sub-directory or protocol name
+    :param folder: The folder holding the file
+    :param filename: Name of the file to download
+    :param fd: An open file descriptor to write into with os.pwrite
+    :param start: First byte offset to fetch
+    :param end: Byte offset to stop at
+    :return: True if the whole range was written
+    """
+    ftp = FTP()
+    offset = start
+    try:
+        ftp.connect(server, timeout=30)
+        ftp.login()
+        ftp.cwd(folder)
+        ftp.voidcmd("TYPE I")
+        with ftp.transfercmd("RETR " + filename, rest=start) as conn:
+            while offset < end:
+                data = conn.recv(min(SEGMENT_BLOCK_SIZE, end - offset))
+                if not data:
+                    break
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+    except ftplib.all_errors as e:
+        print("[FTP] Segment error: ", str(e))
+        return False
+    finally:
+        # Hang up without QUIT, the server may still be busy sending the rest of the file
+        ftp.close()
+    return offset == end
+
+
+async def probe_mirror(server, port, timeout=5.0):
+    """
+    Measure the time needed to open a TCP connection to a server
+    :param server: The server name
+    :param port: The port to connect to
+    :param timeout: time-out threshold in second
+    :return: connect time in second. None if the server cannot be reached.
+    """
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(server, port), timeout)
+    except asyncio.TimeoutError:
+        print("Server ", server, " timed out")
+        return None
+    except socket.gaierror as e:
+        print("Address error for ", server)
+        print(e)
+        return None
+    except OSError as e:  # e.g. connection refused, which would otherwise abort the whole selection
+        print("Cannot connect to ", server)
+        print(e)
+        return None
+    end = time.perf_counter()
+    writer.close()
+    return end - start
+
+
+async def rank_mirrors(server_list, port, timeout):
+    """
+    Probe every server of a list at once
     :param server_list: A list of server names
+    :param port: The port to connect to
+    :param timeout: time-out threshold in second
+    :return: list of (server_name, latency) for reachable servers, fastest first
+    """
+    latencies = await asyncio.gather(*[probe_mirror(server, port, timeout) for server in server_list])
+    benchmark = [(server, latency) for server, latency in zip(server_list, latencies) if latency is not None]
+    return sorted(benchmark, key=itemgetter(1))
+
+
+def select_mirrors(*server_lists, priority=1, protocol="FTP", timeout=5.0):
+    """
+    Select a mirror from each of several server lists based on connection time.
+    All servers of all lists are probed together on one event loop, so the total wait is that of the slowest server.
+    :param server_lists: Lists of server names
     :param priority: 1 for the fastest server, 2 for the 2nd fast, etc.
     :param protocol: Decide PORT to use. Accepts HTTP, HTTPS, FTP, SFTP, SSH
     :param timeout: time-out threshold in second
-    :return: a tuple of (server_name, latency)
+    :return: a list with a tuple of (server_name, latency) for each server list. (None, None) if no server responded.
     """
-    benchmark = {} # to hold the server: connect time pairs
     # Set the ports to connect based on protocol
     port = 1
     if protocol == "HTTP":
@@ -438,65 +867,154 @@ def select_mirror(server_list=[], priority=1, protocol="FTP", timeout=5.0):
         port = 22
     else:
         port = 1
-    # Test each server
-    for server in server_list:
-        # First need a default socket
-        sock = socket.socket()
-        sock.settimeout(timeout)
-        start = time.time()
-        try:
-            sock.connect((server, port))
-            end = time.time()
-            benchmark[server] = end - start
-            sock.close()
-        except socket.herror as e:
-            print("Hostname error for ", server)
-            print(e)
-            sock.close()
-            continue
-        except socket.gaierror as e:
-            print("Address error for ", server)
-            print(e)
-            sock.close()
-            continue
-        except socket.timeout:
-            print("Server ", server, " timed out")
-            sock.close()
+    async def rank_all():
+        return await asyncio.gather(*[rank_mirrors(server_list, port, timeout) for server_list in server_lists])
+
+    loop = asyncio.new_event_loop()  # asyncio.run() needs Python 3.7
+    try:
+        rankings = loop.run_until_complete(rank_all())
+    finally:
+        loop.close()
+
+    selected = []
+    for sorted_servers in rankings:
+        # fix priority number
+        valid_servers = len(sorted_servers)
+        if valid_servers <= 0:
+            print("[WARNING] No mirror available!")
+            selected.append((None, None))
             continue
+        index = min([valid_servers, priority]) - 1
+        index = max([0, index])  # keep it >=0
+        selected.append(sorted_servers[index])
+    return selected
 
-    # fix priority number
-    valid_servers = len(benchmark)
-    if valid_servers <= 0:
-        print("[WARNING] No mirror available!")
-        return None, None
-    priority = min([valid_servers, priority]) - 1
-    priority = max([0, priority])  # keep it >=0
-    # Sort server list
-    sorted_servers = sorted(benchmark.items(), key=itemgetter(1), reverse=False)
-    return sorted_servers[priority]
+
+def select_mirror(server_list=[], priority=1, protocol="FTP", timeout=5.0):
+    """
+    Select a server mirror based on connection time
+    :param server_list: A list of server names
+    :param priority: 1 for the fastest server, 2 for the 2nd fast, etc.
+    :param protocol: Decide PORT to use. Accepts HTTP, HTTPS, FTP, SFTP, SSH
+    :param timeout: time-out threshold in second
+    :return: a tuple of (server_name, latency)
+    """
+    return select_mirrors(server_list, priority=priority, protocol=protocol, timeout=timeout)[0]
 
 
-def ftp_get_by_component(component):
-    os.chdir(WORK_FOLDER)
-    ftp_get(FTP_SERVERS[component], PRIMARY_FTP_FOLDERS[component], FILENAME_PATTERNS[component],
+def ftp_get_by_component(component, borrow_slots=None):
+    save_path = os.path.abspath(os.path.join(WORK_FOLDER, SAVE_PATH[component]))
+    pkg_dir = LOCATIONS["pkg_dir"]
+    # A fresh download is extracted while it arrives; only a tarball kept from an earlier run needs untar
+    cached = os.path.exists(save_path)
+    ftp_get(FTP_SERVERS[component], PRIMARY_FTP_FOLDERS[component], COMPILED_FILENAME_PATTERNS[component],
             FILENAME_VERSION_CAPTURE[component],
-            SAVE_PATH[component], PREFERRED_FILE_VERSION[component], FOLDER_PATTERNS[component],
-            FOLDER_VERSION_CAPTURE[component], PREFERRED_FOLDER_VERSION[component])
-    untar(SAVE_PATH[component], LOCATIONS["pkg_dir"])
+            save_path, PREFERRED_FILE_VERSION[component], COMPILED_FOLDER_PATTERNS[component],
+            FOLDER_VERSION_CAPTURE[component], PREFERRED_FOLDER_VERSION[component], pkg_dir,
+            extract_exclude=EXTRACT_EXCLUDE.get(component, ()), borrow_slots=borrow_slots)
+    if cached:
+        untar(save_path, pkg_dir, exclude=EXTRACT_EXCLUDE.get(component, ()))
+    return component, extracted_folder(save_path, pkg_dir)
 
 
 def html_get_by_component(component):
-    os.chdir(WORK_FOLDER)
-    html_get(HTML_URLS[component], FILENAME_PATTERNS[component], FILENAME_VERSION_CAPTURE[component],
-             SAVE_PATH[component])
-    untar(SAVE_PATH[component], LOCATIONS["pkg_dir"])
+    save_path = os.path.abspath(os.path.join(WORK_FOLDER, SAVE_PATH[component]))
+    pkg_dir = LOCATIONS["pkg_dir"]
+    html_get(HTML_URLS[component], COMPILED_FILENAME_PATTERNS[component], FILENAME_VERSION_CAPTURE[component],
+             save_path)
+    untar(save_path, pkg_dir, exclude=EXTRACT_EXCLUDE.get(component, ()))
+    return component, extracted_folder(save_path, pkg_dir)
+
+
+def extracted_folder(save_path, pkg_dir):
+    """
+    Find where a downloaded tarball was extracted
+    :param save_path: the path to tarball
+    :param pkg_dir: the folder it was extracted into
+    :return: None if failed. The path of the tarball's top folder if success.
+    """
+    top_folder = tarball_top_folder(save_path)
+    if not top_folder:
+        return None
+    return os.path.join(pkg_dir, top_folder)
+
+
+def download_all():
+    """
+    Download and extract every FTP and HTML component concurrently.
+    An event loop hands the downloads to DOWNLOAD_WORKERS threads, keeping at most DOWNLOADS_PER_SERVER
+    connections open for downloads from any one server, so a worker is never left waiting for a busy server
+    while a download from another one could run. A segmented FTP download only gets the extra
+    connections its server has free.
+    :return: a dict of component: extracted source folder. The folder is None if the component failed.
+    """
+    async def fetch(loop, executor, limit, get_by_component, *args):
+        async with limit:
+            return await loop.run_in_executor(executor, get_by_component, *args)
+
+    async def take_free_slots(limit, most):
+        taken = 0
+        while taken < most and not limit.locked():  # acquire() does not wait then
+            await limit.acquire()
+            taken += 1
+        return taken
+
+    def slot_lender(loop, limit):
+        def borrow_slots(most):  # called from a worker thread
+            taken = asyncio.run_coroutine_threadsafe(take_free_slots(limit, most), loop).result()
+
+            def give_back():
+                for _ in range(taken):
+                    loop.call_soon_threadsafe(limit.release)
+            return taken, give_back
+        return borrow_slots
+
+    async def fetch_all(loop, executor):
+        servers = [FTP_SERVERS[component] for component in FTP_DOWNLOADS]
+        servers += [urlparse(HTML_URLS[component])[1] for component in HTML_DOWNLOADS]
+        limits = {server: asyncio.Semaphore(DOWNLOADS_PER_SERVER) for server in servers}
+        jobs = [fetch(loop, executor, limits[FTP_SERVERS[component]], ftp_get_by_component, component,
+                      slot_lender(loop, limits[FTP_SERVERS[component]]))
+                for component in FTP_DOWNLOADS]
+        jobs += [fetch(loop, executor, limits[urlparse(HTML_URLS[component])[1]], html_get_by_component, component)
+                 for component in HTML_DOWNLOADS]
+        return await asyncio.gather(*jobs)  # re-raises the first exception from the workers
+
+    loop = asyncio.new_event_loop()  # asyncio.run() needs Python 3.7
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            results = loop.run_until_complete(fetch_all(loop, executor))
+    finally:
+        loop.close()
+        close_ftp_sessions()
+    return dict(results)
+
+
+class LinkCollector(HTMLParser):
+    """
+    Collect the href of every <a> tag that fully matches a regex, without building a document tree
+    """
+    def __init__(self, regex):
+        super().__init__()
+        self.regex = regex
+        self.links = []  # (href, match object)
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        href = dict(attrs).get("href")
+        if not href:
+            return
+        m = self.regex.fullmatch(href)
+        if m:
+            self.links.append((href, m))
 
 
 def html_get(url, filename_re, file_version_capture_group=1, save_path=None, preferred_version="99"):
     """
     Scrape a HTML page for links, then download the preferred version or the latest
     :param url: The URL string for the HTML page
-    :param filename_re: A regex string that will run against links to search for target files
+    :param filename_re: A regex string or compiled pattern that will run against links to search for target files
     :param file_version_capture_group: Specify which group holds the version string. Default=1
     :param save_path: Folder, filename or full path for saving the downloaded file
     :param preferred_version: A string for your preferred version
@@ -506,19 +1024,28 @@ def html_get(url, filename_re, file_version_capture_group=1, save_path=None, pre
         return None
     if not filename_re:
         return None
-    html = request.urlopen(url)
-    soup = BeautifulSoup(html, "html.parser", from_encoding=html.info().get_param("charset"))
-    file_regex = re.compile(filename_re)
+    try:
+        html = _http.get(url, stream=True, timeout=30)
+        html.raise_for_status()
+    except requests.RequestException as e:
+        print("[HTML] Cannot open ", url, ": ", str(e))
+        return None
+    file_regex = compile_pattern(filename_re)
+    collector = LinkCollector(file_regex)
+    decoder = codecs.getincrementaldecoder(html.encoding or "utf-8")(errors="replace")
+    for chunk in html.iter_content(chunk_size=HTML_CHUNK_SIZE):  # gzip is undone by requests
+        collector.feed(decoder.decode(chunk))
+    collector.feed(decoder.decode(b"", final=True))
+    collector.close()
+    html.close()
     archive_info = {}  # id: url
     version_info = {}  # id: version
     keyid = 0
 
-    for link in soup.find_all("a", href=True):
-        m = file_regex.fullmatch(link["href"])
-        if m:
-            archive_info[keyid] = link["href"]
-            version_info[keyid] = m.group(file_version_capture_group)
-            keyid += 1
+    for href, m in collector.links:
+        archive_info[keyid] = href
+        version_info[keyid] = m.group(file_version_capture_group)
+        keyid += 1
 
     file_id = None
     #  Search for preferred version
@@ -528,7 +1055,7 @@ def html_get(url, filename_re, file_version_capture_group=1, save_path=None, pre
             break
     # If not found, get the latest
     if not file_id:
-        file_id, ver = sorted(version_info.items(), key=itemgetter(1), reverse=False).pop()
+        file_id, ver = max(version_info.items(), key=lambda item: version_key(item[1]))
 
     final_url = archive_info[file_id]
     # make url absolute if not yet
@@ -545,8 +1072,7 @@ def html_get(url, filename_re, file_version_capture_group=1, save_path=None, pre
         dir_name = os.path.dirname(save_path)  # can be empty
         filename = os.path.basename(save_path)  # can be empty
         if dir_name:
-            if not os.path.exists(dir_name):
-                os.makedirs(dir_name)
+            os.makedirs(dir_name, exist_ok=True)
         if filename:
             final_path = save_path
         else:
@@ -558,7 +1084,7 @@ def html_get(url, filename_re, file_version_capture_group=1, save_path=None, pre
         return final_path
     # Download
     print("[HTML] Downloading from ", final_url, " to ", final_path)
-    saved_name, header = request.urlretrieve(final_url, final_path)
+    saved_name = http_download(final_url, final_path)
     if saved_name:
         print("[HTML] Download finished")
         return saved_name
@@ -567,53 +1093,185 @@ def html_get(url, filename_re, file_version_capture_group=1, save_path=None, pre
         return None
 
 
-def hash_file_md5(filename):
+def http_download(url, save_path):
+    """
+    Download a file over HTTP(S) with the shared session, copying the response to disk in large blocks
+    :param url: The URL of the file
+    :param save_path: Full path for saving the file
+    :return: save_path on success. None if failed, in which case nothing is left at save_path.
+    """
+    try:
+        with _http.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True  # undo any Content-Encoding, as iter_content() would
+            with open(save_path, "wb", buffering=DOWNLOAD_BUFFER_SIZE) as file_handle:
+                copyfileobj(response.raw, file_handle, COPY_BUFFER_SIZE)
+    except (requests.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+        print("[HTML] Error downloading ", url, ": ", str(e))
+        if os.path.exists(save_path):
+            os.remove(save_path)
+        return None
+    return save_path
+
+
+def new_cache_hasher():
+    """
+    Create the hash object used for the extraction stamps. The digest only tells whether a tarball
+    changed since it was extracted, so the fastest available hash is used: BLAKE3, then XXH3, then MD5.
+    :return: a hash object with update() and hexdigest()
+    """
+    if blake3:
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    if xxhash:
+        return xxhash.xxh3_64()
+    return hashlib.md5()
+
+
+def hash_file_cache(filename):
     """
-    Obtain a MD5 digest of a file
+    Obtain a digest of a file with new_cache_hasher()
     :param filename: The file to be hashed
-    :return: MD5 digest on success. None if file is not found.
+    :return: hex digest on success. None if file is not found.
     """
     if not os.path.exists(filename):
-        print("[MD5 HASH]:", filename, " not found")
+        print("[CACHE HASH]:", filename, " not found")
         return None
-    md5 = hashlib.md5()
-    with open(filename, "rb") as f:
+    with open(filename, "rb", buffering=0) as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, new_cache_hasher).hexdigest()
+        hasher = new_cache_hasher()
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
         while True:
-            data = f.read(128)
-            if not data:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+    return hasher.hexdigest()
+
+
+def read_cache_stamp(source_archive):
+    """
+    Read the stamp left next to a tarball after it was extracted
+    :param source_archive: the path to tarball
+    :return: a tuple of (digest, size, mtime in ns). Size and mtime are None for stamps holding only a digest.
+    None if there is no stamp or it cannot be read, so the archive is checked again.
+    """
+    stamp_file = source_archive + ".cachehash"
+    if not os.path.exists(stamp_file):
+        return None
+    with open(stamp_file, "r") as f:
+        fields = f.read().split()
+    if not fields:
+        return None
+    if len(fields) < 3:
+        return fields[0], None, None
+    try:
+        return fields[0], int(fields[1]), int(fields[2])
+    except ValueError:  # truncated or edited by hand
+        print("[TAR] Ignoring the damaged stamp ", stamp_file)
+        return None
+
+
+def write_cache_stamp(source_archive, digest):
+    """
+    Record the digest, size and modification time of an extracted tarball
+    :param source_archive: the path to tarball
+    :param digest: hex digest of the tarball from hash_file_cache() or new_cache_hasher()
+    :return: None
+    """
+    info = os.stat(source_archive)
+    with open(source_archive + ".cachehash", "w") as f:
+        f.write("{} {} {}\n".format(digest, info.st_size, info.st_mtime_ns))
+    return None
+
+
+def open_tarball(source_archive):
+    """
+    Open a tarball for reading. Known compressions are decompressed up front and fed to tarfile
+    through a large read buffer, so tarfile reads plain tar data instead of probing each format.
+    :param source_archive: the path to tarball
+    :return: a tuple of (TarFile, decompressed stream). The stream is None if tarfile opened the file itself
+    and must otherwise be closed after the TarFile.
+    """
+    opener = TAR_DECOMPRESSORS.get(os.path.splitext(source_archive)[1])
+    if not opener:
+        return tarfile.open(source_archive), None
+    stream = io.BufferedReader(opener(source_archive, "rb"), buffer_size=TAR_BUFFER_SIZE)
+    return tarfile.open(fileobj=stream, mode="r:"), stream
+
+
+def tar_members(hFile, exclude):
+    """
+    Go through the members of an open tarball, leaving out the excluded ones
+    :param hFile: TarFile object
+    :param exclude: tuple of path prefixes, matched against member names without the tarball's top folder
+    :return: generator of TarInfo
+    """
+    for member in hFile:
+        name = posixpath.normpath(member.name)  # some tarballs name their members ./folder/...
+        if not (name.split("/", 1)[-1] + "/").startswith(exclude):  # "/" so the folder itself matches too
+            yield member
+
+
+def tarball_top_folder(source_archive):
+    """
+    Read the name of the folder a tarball extracts into. Only the first headers are decompressed.
+    :param source_archive: the path to tarball
+    :return: None if failed. The top folder name if success.
+    """
+    if not os.path.exists(source_archive):
+        return None
+    hFile, stream = open_tarball(source_archive)
+    top_folder = None
+    try:
+        for member in hFile:
+            name = posixpath.normpath(member.name)
+            if name != ".":  # the ./ entry of tarballs made with "tar -C folder ."
+                top_folder = name.split("/", 1)[0]
                 break
-            md5.update(data)
-    return md5.hexdigest()
+    finally:
+        hFile.close()
+        if stream:
+            stream.close()
+    return top_folder
 
 
-def untar(source_archive, destination_folder):
+def untar(source_archive, destination_folder, exclude=()):
     """
-    Decompress the source archive tarball into the destination foler
+    Decompress the source archive tarball into the destination foler.
+    Skipped when the tarball's folder is already there and the archive matches its cache stamp.
     :param source_archive: the path to tarball
     :param destination_folder: where to put the extracted files
+    :param exclude: Paths not to extract, see tar_members()
     :return: None if failed. Destination path if success.
     """
     if not os.path.exists(source_archive):
         print("The tarball ", source_archive, " cannot be found")
         return None
-    if not os.path.exists(destination_folder):
-        os.makedirs(destination_folder)
-    source_md5_file = source_archive + ".md5"
-    new_md5 = hash_file_md5(source_archive)
-    if os.path.exists(source_md5_file):
-        old_md5 = None
-        with open(source_md5_file,"r") as f:
-            old_md5 = f.read()
-        if new_md5 in old_md5:
-            print("[TAR] Same archive found. Skipping")
-            return destination_folder
-
-    hFile = tarfile.open(source_archive)
+    os.makedirs(destination_folder, exist_ok=True)
+    new_digest = None
+    top_folder = tarball_top_folder(source_archive)
+    if top_folder and os.path.isdir(os.path.join(destination_folder, top_folder)):
+        stamp = read_cache_stamp(source_archive)
+        if stamp:
+            old_digest, old_size, old_mtime = stamp
+            info = os.stat(source_archive)
+            if (info.st_size, info.st_mtime_ns) == (old_size, old_mtime):
+                print("[TAR] Same archive found. Skipping")
+                return destination_folder
+            new_digest = hash_file_cache(source_archive)
+            if new_digest == old_digest:
+                print("[TAR] Same archive found. Skipping")
+                write_cache_stamp(source_archive, new_digest)  # record the new size and time for next run
+                return destination_folder
+
+    hFile, stream = open_tarball(source_archive)
     if hFile:
         print("[TAR] Extracting ", source_archive, " to ", destination_folder)
         extract_ok = False
         try:
-            hFile.extractall(destination_folder)
+            hFile.extractall(destination_folder, members=tar_members(hFile, exclude))
             extract_ok = True
         except tarfile.ExtractError as e:
             print("Error extracting tarfile: skipping")
@@ -622,10 +1280,11 @@ def untar(source_archive, destination_folder):
             print("IO error: skipping")
             print(str(e))
         hFile.close()
+        if stream:
+            stream.close()
         print("[TAR] Extraction finished")
         if extract_ok:
-            with open(source_md5_file, "w") as f:
-                f.write(new_md5)
+            write_cache_stamp(source_archive, new_digest or hash_file_cache(source_archive))
         return destination_folder
     else:
         print("Cannot open tarball ", source_archive, " for extraction")
@@ -633,11 +1292,10 @@ def untar(source_archive, destination_folder):
 
 
 def guess_config():
-    global WORK_FOLDER
-    os.chdir(WORK_FOLDER)
-    saved_name, header = request.urlretrieve(CONFIG_GUESS, os.path.join(WORK_FOLDER, "config.guess"))
+    config_path = os.path.join(WORK_FOLDER, "config.guess")
+    http_download(CONFIG_GUESS, config_path)
 
-    if not os.path.exists("./config.guess"):
+    if not os.path.exists(config_path):
         return None
     shell_type = os.getenv("SHELL")
 
@@ -648,382 +1306,438 @@ def guess_config():
         print("guess.config need to be run in bash-like shell")
         return None
 
-    system_string = subprocess.run(["sh", "config.guess"], stdout=subprocess.PIPE).stdout.decode("utf-8")
+    system_string = subprocess.run(["sh", config_path], stdout=subprocess.PIPE).stdout.decode("utf-8")
 
     return system_string
 
 
+def run_logged(command, log_file, cwd=None, env=None, log_stdout=True):
+    """
+    Run a command with its stdout and stderr written straight into a log file.
+    On CI (CI set in the environment) the output is also copied to our stdout, so it shows in the job log.
+    :param command: argument list as for subprocess.run
+    :param log_file: path of the log file, overwritten on every run. Relative paths are taken from cwd.
+    :param cwd: folder to run the command in. Current folder if None.
+    :param env: environment variables for the command. Inherit ours if None.
+    :param log_stdout: if False, stdout is thrown away off CI and only stderr goes to the log file
+    :return: the CompletedProcess object, without captured output
+    """
+    if cwd:
+        log_file = os.path.join(cwd, log_file)
+    with open(log_file, "wb", buffering=LOG_BUFFER_SIZE) as log:
+        # Our own descriptors are not inheritable apart from the jobserver pipe, so close_fds can be skipped.
+        # That saves the child a close() on every possible descriptor number on Pythons without close_range().
+        if not IS_CI:
+            return subprocess.run(command, stdout=log if log_stdout else subprocess.DEVNULL,
+                                  stderr=subprocess.STDOUT if log_stdout else log, cwd=cwd,
+                                  env=jobserver_env(env), close_fds=False)
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd,
+                              env=jobserver_env(env), close_fds=False, bufsize=LOG_BUFFER_SIZE) as process:
+            for chunk in iter(functools.partial(process.stdout.read1, LOG_BUFFER_SIZE), b""):
+                log.write(chunk)
+                with _print_lock:
+                    sys.stdout.flush()  # text printed before has to come out ahead of the raw bytes
+                    sys.stdout.buffer.write(chunk)
+                    sys.stdout.flush()
+        return subprocess.CompletedProcess(command, process.returncode)
+
+
+_trash_numbers = itertools.count()
+
+
+def purge_folder(folder):
+    """
+    Delete a folder without waiting for it. The folder is renamed out of the way at once,
+    so it can be recreated right away, and rm -rf removes the renamed copy in a background thread.
+    Copies left behind by an earlier run that was stopped before removing them go in the same rm -rf.
+    The script does not exit before that thread is finished.
+    :param folder: path of the folder. Nothing is done if it does not exist.
+    :return: None
+    """
+    folder = os.path.abspath(folder)
+    if not os.path.exists(folder):
+        return None
+    own_prefix = "{0}.trash.{1}.".format(folder, os.getpid())
+    trash = own_prefix + str(next(_trash_numbers))  # unique, so purging a folder twice never clashes
+    # other runs' trash only, ours may still be in the hands of an earlier rm -rf thread
+    stale = [path for path in glob.glob(glob.escape(folder) + ".trash.*") if not path.startswith(own_prefix)]
+    try:
+        os.rename(folder, trash)
+    except OSError:
+        subprocess.run(["rm", "-rf", folder] + stale)
+        return None
+    threading.Thread(target=subprocess.run, args=(["rm", "-rf", trash] + stale,), daemon=False).start()
+    return None
+
+
+@functools.lru_cache(maxsize=1)
 def run_nproc():
     """
-    Get cpu count via nproc
+    Get the number of cpu cores this process may run on, like nproc does
     :return: number of cpu core
     """
-    return_string = subprocess.run(["nproc"], stdout=subprocess.PIPE).stdout.decode("utf-8")
-    cores = int(return_string)
+    if hasattr(os, "sched_getaffinity"):  # respects taskset and container cpu limits
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
     if cores > 2:
         return cores-1
     else:
         return cores
 
 
-def set_env(x86_64=True):
+CPU_CORES = run_nproc()  # total make jobs across all builds running at the same time
+
+
+@functools.lru_cache(maxsize=None)
+def jobserver():
     """
-    Set environment variables for specific compiler usage
-    :param x86_64: When True[default], set for 64bit usage, 32bit otherwise
-    :return: a map with "old_path" and "old_cc"
+    Create the GNU make jobserver shared by every make this script starts. It is a pipe holding
+    one token per job slot beyond the one each make owns, so builds running side by side
+    take jobs from the same pool instead of each starting CPU_CORES of their own.
+    Both ends are inheritable, so every child process gets them.
+    :return: tuple of the read and write file descriptors
     """
-    origin = {
-        "old_path": os.environ["PATH"],
-        "old_cc": os.environ["CC"]
-    }
-    current_dir = os.getcwd()
-    global WORK_FOLDER, LOCATIONS, TARGET
-    os.chdir(WORK_FOLDER)
-    prefix_x86 = os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"])
-    prefix_x86 = os.path.join(prefix_x86, "bin")
-    prefix_x86_64 = os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    prefix_x86_64 = os.path.join(prefix_x86_64, "bin")
-    old_path_var = os.environ["PATH"]
-    x86_env_path = prefix_x86 + ":" + old_path_var
-    x86_64_env_path = prefix_x86_64 + ":" + old_path_var
-    if x86_64:
-        os.environ["PATH"] = x86_64_env_path
-    else:
-        os.environ["PATH"] = x86_env_path
-    os.environ["CC"] = "gcc"
-    os.chdir(current_dir)
-    return origin
+    read_fd, write_fd = os.pipe()
+    os.set_inheritable(read_fd, True)
+    os.set_inheritable(write_fd, True)
+    os.write(write_fd, b"+" * (CPU_CORES - 1))
+    return read_fd, write_fd
 
 
-def restore_env(old_env):
+def jobserver_env(env=None):
     """
-    Restore environment variables as changed by set_env()
-    :param old_env: the map returned by set_env()
-    :return: None
+    Environment that points make at the shared jobserver. The child has to keep the inherited
+    descriptors open, as run_logged() does with close_fds=False.
+    :param env: environment variables to start from. A copy of ours if None.
+    :return: new dict with MAKEFLAGS set
     """
-    old_cc = old_env["old_cc"]
-    old_path = old_env["old_path"]
-
-    if old_cc:
-        os.environ["CC"] = old_cc
-    if old_path:
-        os.environ["PATH"] = old_path
+    env = dict(os.environ if env is None else env)
+    read_fd, write_fd = jobserver()
+    # make 4.2 renamed --jobserver-fds to --jobserver-auth but still accepts the old name, which make 4.0 and 4.1
+    # need. Older makes are not supported anyway, make_args() passes --output-sync.
+    env["MAKEFLAGS"] = "{0} -j{1} --jobserver-fds={2},{3}".format(env.get("MAKEFLAGS", ""), CPU_CORES,
+                                                                read_fd, write_fd).lstrip()
+    return env
 
 
-def build_binutils(source_folder, build_folder, system_type):
+def make_args(*targets):
     """
-    Build both x86 and x86_64 versions of Binutils
-    :param source_folder: The folder containing the source code for Binutils
-    :param build_folder: A folder outside of source_folder for building
-    :param system_type: a string as returned by guess_config function
-    :return: None if failed
+    Command line for every make the script runs, install targets included.
+    The job count comes from the jobserver in MAKEFLAGS, jobs are held back while the load average
+    is above CPU_CORES, and each recursive make's output is written out in one piece instead of interleaving.
+    :param targets: make targets, none for the default target
+    :return: argument list for run_logged
     """
-    global WORK_FOLDER, LOCATIONS, TARGET
-    os.chdir(WORK_FOLDER)
-    i686_prefix = os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"])
-    x86_64_prefix = os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    full_source_path = os.path.abspath(source_folder)
-    full_build_path = os.path.abspath(build_folder)
+    return ["make", "-l", str(CPU_CORES), "--output-sync=recurse"] + list(targets)
+
+
+def run_build_steps(name, steps, cwd=None, env=None):
+    """
+    Run the configure, build and install steps of a component in order through run_logged(),
+    stopping at the first one that fails. The stdout of install steps, a line for every installed file,
+    is not logged off CI.
+    :param name: component, and architecture if any, used in messages
+    :param steps: list of (step, command, log_file) tuples, step being a key of BUILD_STEP_VERBS
+    :param cwd: build folder the commands run in, and the log files are written to. Current folder if None.
+    :param env: environment variables for the commands. Inherit ours if None.
+    :return: True on success, None when a step failed
+    """
+    for step, command, log_file in steps:
+        print_line(BUILD_STEP_VERBS[step] + " " + name + "...")
+        result = run_logged(command, log_file, cwd=cwd, env=env, log_stdout=step != "install")
+        if result.returncode:
+            print_error("Failed to " + step + " " + name)
+            return None
+    return True
+
+
+def resolve_locations():
+    """
+    Make the LOCATIONS paths absolute, relative ones being taken from WORK_FOLDER, and fill in
+    PREFIXES and PREFIX_BINS. Done once when WORK_FOLDER is known, the builders then use them as they are.
+    :return: None
+    """
+    for item, path in LOCATIONS.items():
+        path = os.path.expanduser(os.path.expandvars(path))
+        LOCATIONS[item] = os.path.abspath(os.path.join(WORK_FOLDER, path))
+    for arch in TARGET:
+        PREFIXES[arch] = LOCATIONS["mingw_w64_" + arch + "_prefix"]
+        PREFIX_BINS[arch] = os.path.join(PREFIXES[arch], "bin")
+    return None
+
+
+def tmpfs_build_folder():
+    """
+    Pick a build folder on the RAM-backed TMPFS_FOLDER, so object files are never written back to disk.
+    Only the build folder moves there, the prefixes stay in the sandbox. The name is derived from
+    WORK_FOLDER so a later run of the same sandbox finds its configured build folders again.
+    :return: path of the folder, None if TMPFS_FOLDER is missing or has less than TMPFS_MIN_FREE free
+    """
+    try:
+        vfs = os.statvfs(TMPFS_FOLDER)
+    except OSError:
+        return None
+    if vfs.f_bavail * vfs.f_frsize < TMPFS_MIN_FREE:
+        return None
+    sandbox_id = hashlib.md5(WORK_FOLDER.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(TMPFS_FOLDER, "pyMingwBuild-" + str(os.getuid()) + "-" + sandbox_id)
+
+
+def build_env(x86_64=True):
+    """
+    Environment variables for building with the host compiler, with a Mingw-w64 toolchain on PATH
+    :param x86_64: When True[default], set for 64bit usage, 32bit otherwise
+    :return: a copy of os.environ with PATH, CC and CXX set, for the env argument of subprocess.run
+    """
+    prefix_bin = PREFIX_BINS["x86_64" if x86_64 else "i686"]
+    return with_host_ccache(dict(os.environ, PATH=prefix_bin + ":" + ORIGINAL_PATH))
+
+
+def with_ccache(env, cc, cxx=None):
+    """
+    Set the compilers in an environment dict, run through ccache if it is installed.
+    The cache is kept in the sandbox outside the build folders, so it survives rebuilds.
+    Paths are hashed relative to the folder holding both the sandbox and the build folder,
+    or to the build folder alone when that is in RAM and the two only share /.
+    :param env: environment variables for a build, updated in place
+    :param cc: C compiler for CC
+    :param cxx: C++ compiler for CXX. CXX is left alone if None.
+    :return: env
+    """
+    if CCACHE:
+        sandbox = os.path.abspath(WORK_FOLDER)
+        build_dir = os.path.abspath(LOCATIONS["mingw_w64_build_dir"])
+        base_dir = os.path.commonpath([sandbox, build_dir])
+        cc = CCACHE + " " + cc
+        if cxx:
+            cxx = CCACHE + " " + cxx
+        env.setdefault("CCACHE_DIR", os.path.join(sandbox, "ccache"))
+        env.setdefault("CCACHE_BASEDIR", build_dir if base_dir == "/" else base_dir)
+        env.setdefault("CCACHE_COMPILERCHECK", "content")  # the cross compilers are rebuilt with new mtimes
+        env.setdefault("CCACHE_SLOPPINESS", "pch_defines,time_macros")
+    env["CC"] = cc
+    if cxx:
+        env["CXX"] = cxx
+    return env
+
+
+def with_host_ccache(env):
+    """
+    with_ccache() for the host compilers, keeping CC and CXX when they are set, e.g. CXX=g++-5 on Travis
+    :param env: environment variables for a build, updated in place
+    :return: env
+    """
+    return with_ccache(env, env.get("CC", "gcc"), env.get("CXX", "g++"))
+
+
+def build_binutils(source_folder, build_folder, system_type):
+    """
+    Build both x86 and x86_64 versions of Binutils. The two builds run side by side.
+    :param source_folder: The folder containing the source code for Binutils
+    :param build_folder: A folder outside of source_folder for building
+    :param system_type: a string as returned by guess_config function
+    :return: None if failed
+    """
+    i686_prefix = PREFIXES["i686"]
+    x86_64_prefix = PREFIXES["x86_64"]
+    full_source_path = os.path.abspath(os.path.join(WORK_FOLDER, source_folder))
+    full_build_path = os.path.abspath(os.path.join(WORK_FOLDER, build_folder))
     full_build_path = os.path.join(full_build_path, "binutils")
     build_path_x86 = os.path.join(full_build_path, "x86")
     build_path_x86_64 = os.path.join(full_build_path, "x86_64")
-    # print(i686_prefix)
-    # print(x86_64_prefix)
-    # print(full_source_path)
-    # print(full_build_path)
-    # print(build_path_x86)
-    # print(build_path_x86_64)
     # purge old build file
     if os.path.exists(full_build_path):
         print("Deleting old Binutils build folders")
-        rmtree(full_build_path)
+        purge_folder(full_build_path)
     # recreate folders
     os.makedirs(build_path_x86)
     os.makedirs(build_path_x86_64)
     # create prefix paths if absent
-    if not os.path.exists(i686_prefix):
-        os.makedirs(i686_prefix)
-    if not os.path.exists(x86_64_prefix):
-        os.makedirs(x86_64_prefix)
-    # build x86
-    os.chdir(build_path_x86)
-    os.environ["CC"] = "gcc"
+    os.makedirs(i686_prefix, exist_ok=True)
+    os.makedirs(x86_64_prefix, exist_ok=True)
     configure_script = os.path.join(full_source_path, "configure")
-    arg_build = "--build=" + system_type
-    arg_target = "--target=" + TARGET["i686"]
-    arg_prefix = "--prefix=" + i686_prefix
-    arg_sysroot = "--with-sysroot=" + i686_prefix
-    arg_others = "--disable-multilib --disable-nls --disable-shared --enable-static"
-    print("Configuring Binutils x86...")
-    run_result = subprocess.run(["sh", configure_script, arg_build, arg_target, arg_prefix, arg_sysroot,
-                                 "--disable-multilib", "--disable-nls", "--disable-shared", "--enable-static"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if run_result.returncode:
-        print("Error configuring Binutils x86!")
-        output_message = run_result.stdout.decode("utf-8")
-        error_message = run_result.stderr.decode("utf-8")
-        with open("./configure_error.log", "w") as file_handle:
-            file_handle.write(output_message)
-            file_handle.write(error_message)
-        return None
-    print("Done configuring Binutils x86")
-    cpu_count = str(run_nproc())
-    print("Building Binutils x86")
-    run_result = subprocess.run(["make", "-j", str(cpu_count)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if run_result.returncode:
-        print("Error building Binutils x86!")
-        output_message = run_result.stdout.decode("utf-8")
-        error_message = run_result.stderr.decode("utf-8")
-        with open("./make_error.log", "w") as file_handle:
-            file_handle.write(output_message)
-            file_handle.write(error_message)
+    env = with_host_ccache(dict(os.environ))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(build_binutils_arch, "x86", configure_script, build_path_x86, TARGET["i686"],
+                            i686_prefix, system_type, env),
+            executor.submit(build_binutils_arch, "x86_64", configure_script, build_path_x86_64, TARGET["x86_64"],
+                            x86_64_prefix, system_type, env)
+        ]
+        results = [future.result() for future in futures]
+    if not all(results):
         return None
-    print("Finished building Binutils x86")
-    print("Installing Binutils x86")
-    run_result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if run_result.returncode:
-        print("Error installing Binutils x86!")
-        output_message = run_result.stdout.decode("utf-8")
-        error_message = run_result.stderr.decode("utf-8")
-        with open("./make_error.log", "w") as file_handle:
-            file_handle.write(output_message)
-            file_handle.write(error_message)
-        return None
-    # build x86_64
-    os.chdir(build_path_x86_64)
-    arg_target = "--target=" + TARGET["x86_64"]
-    arg_prefix = "--prefix=" + x86_64_prefix
-    arg_sysroot = "--with-sysroot=" + x86_64_prefix
-    print("Configuring Binutils x86_64...")
-    run_result = subprocess.run(["sh", configure_script, arg_build, arg_target, arg_prefix, arg_sysroot,
-                                 "--disable-multilib", "--disable-nls", "--disable-shared", "--enable-static"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if run_result.returncode:
-        print("Error configuring Binutils x86_64!")
-        output_message = run_result.stdout.decode("utf-8")
-        error_message = run_result.stderr.decode("utf-8")
-        with open("./configure_error.log", "w") as file_handle:
-            file_handle.write(output_message)
-            file_handle.write(error_message)
-        return None
-    print("Done configuring Binutils x86_64")
-    print("Building Binutils x86_64")
-    run_result = subprocess.run(["make", "-j", str(cpu_count)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if run_result.returncode:
-        print("Error building Binutils x86_64!")
-        output_message = run_result.stdout.decode("utf-8")
-        error_message = run_result.stderr.decode("utf-8")
-        with open("./make_error.log", "w") as file_handle:
-            file_handle.write(output_message)
-            file_handle.write(error_message)
-        return None
-    print("Finished building Binutils x86_64")
-    print("Installing Binutils x86_64")
-    run_result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if run_result.returncode:
-        print("Error installing Binutils x86!")
-        output_message = run_result.stdout.decode("utf-8")
-        error_message = run_result.stderr.decode("utf-8")
-        with open("./make_error.log", "w") as file_handle:
-            file_handle.write(output_message)
-            file_handle.write(error_message)
-        return None
-    os.chdir(WORK_FOLDER)
     return True
 
 
+def build_binutils_arch(arch_name, configure_script, build_path, target, prefix, system_type, env):
+    """
+    Configure, build and install Binutils for one target.
+    :param arch_name: Architecture name used in messages
+    :param configure_script: Path to Binutils' configure script
+    :param build_path: Empty folder for this build
+    :param target: Target triplet
+    :param prefix: Install prefix, also used as sysroot
+    :param system_type: a string as returned by guess_config function
+    :param env: Environment variables for the build
+    :return: None if failed. True on success.
+    """
+    arg_build = "--build=" + system_type
+    arg_target = "--target=" + target
+    arg_prefix = "--prefix=" + prefix
+    arg_sysroot = "--with-sysroot=" + prefix
+    return run_build_steps("Binutils " + arch_name, [
+        ("configure", ["sh", configure_script, arg_build, arg_target, arg_prefix, arg_sysroot,
+                       "--disable-multilib", "--disable-nls", "--disable-shared", "--enable-static"], "configure.log"),
+        ("build", make_args(), "build.log"),
+        ("install", make_args("install"), "install.log")
+    ], cwd=build_path, env=env)
+
+
 def build_mingw_header(source_folder, build_folder, system_type):
     """
-    Config and Install Mingw-w64 header files and make symlinks
+    Config and Install Mingw-w64 header files and make symlinks. x86 and x86_64 are installed side by side.
     :param source_folder: Path to mingw-w64 source folder
     :param build_folder: Build location outside source folder
     :param system_type: string as returned by guess_config()
     :return: None if failed. True if success.
     """
-    global WORK_FOLDER, LOCATIONS, TARGET
-    os.chdir(WORK_FOLDER)
-    config_source = os.path.join(os.path.abspath(source_folder), "mingw-w64-headers", "configure")
-    prefix_x86 = os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"])
-    prefix_x86_64 = os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    build_common = os.path.join(os.path.abspath(build_folder), "header")
-    build_x86 = os.path.join(os.path.abspath(build_folder), "header", "x86")
-    build_x86_64 = os.path.join(os.path.abspath(build_folder), "header", "x86_64")
-    arg_build = "--build=" + system_type
-    arg_host = "--host=" + TARGET["i686"]
-    arg_prefix = "--prefix=" + prefix_x86
+    config_source = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, source_folder)),
+                                 "mingw-w64-headers", "configure")
+    prefix_x86 = PREFIXES["i686"]
+    prefix_x86_64 = PREFIXES["x86_64"]
+    build_common = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, build_folder)), "header")
+    build_x86 = os.path.join(build_common, "x86")
+    build_x86_64 = os.path.join(build_common, "x86_64")
     # purge old build file
-    if os.path.exists(build_common):
-        rmtree(build_common)
+    purge_folder(build_common)
     # create working folders
     os.makedirs(build_x86)
     os.makedirs(build_x86_64)
-    # set path, save old path for x86_64 use
-    old_path_var = os.environ["PATH"]
-    x86_env_path = prefix_x86 + ":" + old_path_var
-    x86_64_env_path = prefix_x86_64 + ":" + old_path_var
-    os.environ["PATH"] = x86_env_path
-    # configure x86
-    os.chdir(build_x86)
-    print("Configuring Mingw-w64 x86 headers...")
-    result = subprocess.run(["sh", config_source, "--enable-sdk-all", arg_build
-                             , arg_host, arg_prefix], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode:
-        print("Failed to configure Mingw-w64 x86 headers!")
-        log_file = os.path.join(build_x86, "config_error.log")
-        with open(log_file, "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
+    # each arch gets its own PATH instead of changing ours
+    env_x86 = dict(os.environ, PATH=prefix_x86 + ":" + ORIGINAL_PATH)
+    env_x86_64 = dict(os.environ, PATH=prefix_x86_64 + ":" + ORIGINAL_PATH)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(build_mingw_header_arch, "x86", config_source, build_x86, TARGET["i686"],
+                            prefix_x86, system_type, env_x86),
+            executor.submit(build_mingw_header_arch, "x86_64", config_source, build_x86_64, TARGET["x86_64"],
+                            prefix_x86_64, system_type, env_x86_64)
+        ]
+        results = [future.result() for future in futures]
+    if not all(results):
         return None
-    print("Configured Mingw-w64 x86 headers")
-    # Install headers
-    print("Installing Mingw-w64 x86 headers...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode:
-        print("Failed to install Mingw-w64 x86 headers!")
-        log_file = os.path.join(build_x86, "install_error.log")
-        with open(log_file, "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        return None
-    print("[OK] Mingw-w64 x86 headers installed")
     print("Making symlinks...")
-    os.chdir(prefix_x86)
-    target_folder = "./" + TARGET["i686"]
-    include_folder = os.path.join(target_folder, "include")
-    if not os.path.exists("./mingw"):
-        os.symlink(target_folder, "./mingw")
-    if not os.path.exists(include_folder):
-        os.chdir(target_folder)
-        os.symlink("../include", "./include")
-        os.chdir(prefix_x86)
+    for prefix, target in ((prefix_x86, TARGET["i686"]), (prefix_x86_64, TARGET["x86_64"])):
+        target_folder = "./" + target
+        mingw_link = os.path.join(prefix, "mingw")
+        include_folder = os.path.join(prefix, target, "include")
+        try:
+            os.symlink(target_folder, mingw_link)
+        except FileExistsError:
+            pass
+        try:
+            os.symlink("../include", include_folder)
+        except FileExistsError:
+            pass
     print("[OK] symlinks done")
-    # x86_64 part
-    os.environ["PATH"] = x86_64_env_path
-    arg_host = "--host=" + TARGET["x86_64"]
-    arg_prefix = "--prefix=" + prefix_x86_64
-    # configure x86_64
-    os.chdir(build_x86_64)
-    print("Configuring Mingw-w64 x86_64 headers...")
-    result = subprocess.run(["sh", config_source, "--enable-sdk-all", arg_build
-                                , arg_host, arg_prefix], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode:
-        print("Failed to configure Mingw-w64 x86 headers!")
-        log_file = os.path.join(build_x86_64, "config_error.log")
-        with open(log_file, "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        return None
-    print("Configured Mingw-w64 x86_64 headers")
-    # Install headers
-    print("Installing Mingw-w64 x86_64 headers...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode:
-        print("Failed to install Mingw-w64 x86_64 headers!")
-        log_file = os.path.join(build_x86_64, "install_error.log")
-        with open(log_file, "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        return None
-    print("[OK] Mingw-w64 x86_64 headers installed")
-    print("Making symlinks...")
-    os.chdir(prefix_x86_64)
-    target_folder = "./" + TARGET["x86_64"]
-    include_folder = os.path.join(target_folder, "include")
-    if not os.path.exists("./mingw"):
-        os.symlink(target_folder, "./mingw")
-    if not os.path.exists(include_folder):
-        os.chdir(target_folder)
-        os.symlink("../include", "./include")
-        os.chdir(prefix_x86_64)
-    os.chdir(WORK_FOLDER)
-    os.environ["PATH"] = old_path_var
-    print("[OK] symlink done")
     return True
 
 
-def build_gmp(source_folder, build_folder, system_type):
+def build_mingw_header_arch(arch_name, configure_script, build_path, target, prefix, system_type, env):
     """
-    Build GMP library
-    :param source_folder: Source folder of GMP
-    :param build_folder: Folder for holding build
+    Configure and install Mingw-w64 headers for one target.
+    :param arch_name: Architecture name used in messages
+    :param configure_script: Path to the configure script of mingw-w64-headers
+    :param build_path: Empty folder for this build
+    :param target: Target triplet
+    :param prefix: Install prefix
     :param system_type: string as returned by guess_config()
-    :return: gmp_prefix string on success, None on Fail.
+    :param env: Environment variables for the build
+    :return: None if failed. True if success.
     """
-    global WORK_FOLDER, LOCATIONS
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
-    abs_build = os.path.abspath(build_folder)
-    abs_pkg = os.path.abspath(LOCATIONS["pkg_dir"])
-    build_common = os.path.join(abs_build, "gmp")
+    arg_build = "--build=" + system_type
+    arg_host = "--host=" + target
+    arg_prefix = "--prefix=" + prefix
+    state = run_build_steps("Mingw-w64 " + arch_name + " headers", [
+        ("configure", ["sh", configure_script, "--enable-sdk-all", arg_build, arg_host, arg_prefix], "configure.log"),
+        ("install", make_args("install"), "install.log")
+    ], cwd=build_path, env=env)
+    if state:
+        print_line("[OK] Mingw-w64 " + arch_name + " headers installed")
+    return state
+
+
+def build_host_library(name, source_folder, build_folder, system_type, extra_args=()):
+    """
+    Configure, build and install one of the libraries GCC depends on (GMP, MPFR, ISL, CLoog, MPC)
+    with the host compiler. The configure arguments come from HOST_LIBRARY_ARGS.
+    The build folder of an earlier run is reused if it was configured with the same command and compilers.
+    A library is only built once per run, later calls return the prefix recorded in HOST_PREFIXES.
+    :param name: key of the library in HOST_LIBRARY_NAMES
+    :param source_folder: Source folder of the library
+    :param build_folder: Build folder
+    :param system_type: string as returned by guess_config()
+    :param extra_args: configure arguments pointing to the libraries this one depends on
+    :return: install prefix on success, None when failed
+    """
+    if name in HOST_PREFIXES:
+        return HOST_PREFIXES[name]
+    display_name = HOST_LIBRARY_NAMES[name]
+    abs_source = os.path.abspath(os.path.join(WORK_FOLDER, source_folder))
+    abs_build = os.path.abspath(os.path.join(WORK_FOLDER, build_folder))
+    abs_pkg = LOCATIONS["pkg_dir"]
+    build_common = os.path.join(abs_build, name)
     config_path = os.path.join(abs_source, "configure")
-    uname_info = os.uname()
-    prefix = os.path.join(abs_pkg, "gmp", "gmp-"+uname_info.machine)
-    # purge build folder
-    if os.path.exists(build_common):
-        rmtree(build_common)
-    os.makedirs(build_common)
-    os.chdir(build_common)
+    prefix = os.path.join(abs_pkg, name, name + "-" + MACHINE)
     arg_build = "--build=" + system_type
     arg_prefix = "--prefix=" + prefix
-    old_env = None
-    if "64" in uname_info.machine:
-        old_env = set_env()
+    env = build_env("64" in MACHINE)
+    configure_command = ["sh", config_path, arg_build, arg_prefix] + list(extra_args) + HOST_LIBRARY_ARGS[name]
+    # A build folder configured the same way is kept, so make only recompiles what changed
+    config_stamp = os.path.join(build_common, ".config.stamp")
+    stamp = "\n".join(configure_command + ["CC=" + env["CC"], "CXX=" + env.get("CXX", "")])
+    old_stamp = None
+    if os.path.exists(config_stamp) and os.path.exists(os.path.join(build_common, "Makefile")):
+        with open(config_stamp, "r") as f:
+            old_stamp = f.read()
+    if old_stamp == stamp:
+        print(display_name + " is configured already, building incrementally")
     else:
-        old_env = set_env(False)
-    print("Configuring GMP...")
-    result = subprocess.run(["sh", config_path, arg_build, arg_prefix, "--enable-fat",
-                             "--disable-shared", "--enable-static", "--enable-cxx",
-                             "CPPFLAGS=-fexceptions"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error configuring GMP!")
-        with open("config_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
+        # purge build folder
+        purge_folder(build_common)
+        os.makedirs(build_common)
+        print("Configuring " + display_name + "...")
+        result = run_logged(configure_command, "configure.log", cwd=build_common, env=env)
 
-    cpu_cores = str(run_nproc())
-    print("Building GMP...")
-    result = subprocess.run(["make", "-j", cpu_cores], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error building GMP!")
-        with open("build_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-    print("Installing GMP...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error installing GMP!")
-        with open("install_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
+        if result.returncode:
+            print("Error configuring " + display_name + "!")
+            return None
+        with open(config_stamp, "w") as f:
+            f.write(stamp)
+
+    if not run_build_steps(display_name, [
+        ("build", make_args(), "build.log"),
+        ("install", make_args("install"), "install.log")
+    ], cwd=build_common, env=env):
         return None
 
-    restore_env(old_env)
-    os.chdir(WORK_FOLDER)
+    HOST_PREFIXES[name] = prefix
     return prefix
 
 
+def build_gmp(source_folder, build_folder, system_type):
+    """
+    Build GMP library
+    :param source_folder: Source folder of GMP
+    :param build_folder: Folder for holding build
+    :param system_type: string as returned by guess_config()
+    :return: gmp_prefix string on success, None on Fail.
+    """
+    return build_host_library("gmp", source_folder, build_folder, system_type)
+
+
 def build_mpfr(source_folder, build_folder, system_type, gmp_prefix):
     """
     Build MPFR library. Depends on GMP.
@@ -1033,72 +1747,7 @@ def build_mpfr(source_folder, build_folder, system_type, gmp_prefix):
     :param gmp_prefix: string as returned by build_gmp()
     :return: mpfr_prefix on success, None when failed
     """
-    global WORK_FOLDER, LOCATIONS
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
-    abs_build = os.path.abspath(build_folder)
-    abs_pkg = os.path.abspath(LOCATIONS["pkg_dir"])
-    build_common = os.path.join(abs_build, "mpfr")
-    config_path = os.path.join(abs_source, "configure")
-    uname_info = os.uname()
-    prefix = os.path.join(abs_pkg, "mpfr", "mpfr-" + uname_info.machine)
-    # purge build folder
-    if os.path.exists(build_common):
-        rmtree(build_common)
-    os.makedirs(build_common)
-    os.chdir(build_common)
-    arg_build = "--build=" + system_type
-    arg_prefix = "--prefix=" + prefix
-    arg_gmp = '--with-gmp=' + gmp_prefix
-    old_env = None
-    if "64" in uname_info.machine:
-        old_env = set_env()
-    else:
-        old_env = set_env(False)
-    print("Configuring MPFR...")
-    result = subprocess.run(["sh", config_path, arg_build, arg_prefix, arg_gmp,
-                             "--disable-shared", "--enable-static"],
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error configuring MPFR!")
-        with open("config_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-
-    cpu_cores = str(run_nproc())
-    print("Building MPFR...")
-    result = subprocess.run(["make", "-j", cpu_cores], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error building MPFR!")
-        with open("build_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-    print("Installing MPFR...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error installing MPFR!")
-        with open("install_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-
-    restore_env(old_env)
-    os.chdir(WORK_FOLDER)
-    return prefix
+    return build_host_library("mpfr", source_folder, build_folder, system_type, ["--with-gmp=" + gmp_prefix])
 
 
 def build_isl(source_folder, build_folder, system_type, gmp_prefix):
@@ -1110,72 +1759,7 @@ def build_isl(source_folder, build_folder, system_type, gmp_prefix):
     :param gmp_prefix: string as returned by build_gmp()
     :return: isl_prefix on success, None when failed
     """
-    global WORK_FOLDER, LOCATIONS
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
-    abs_build = os.path.abspath(build_folder)
-    abs_pkg = os.path.abspath(LOCATIONS["pkg_dir"])
-    build_common = os.path.join(abs_build, "isl")
-    config_path = os.path.join(abs_source, "configure")
-    uname_info = os.uname()
-    prefix = os.path.join(abs_pkg, "isl", "isl-" + uname_info.machine)
-    # purge build folder
-    if os.path.exists(build_common):
-        rmtree(build_common)
-    os.makedirs(build_common)
-    os.chdir(build_common)
-    arg_build = "--build=" + system_type
-    arg_prefix = "--prefix=" + prefix
-    arg_gmp = '--with-gmp-prefix=' + gmp_prefix
-    old_env = None
-    if "64" in uname_info.machine:
-        old_env = set_env()
-    else:
-        old_env = set_env(False)
-    print("Configuring ISL...")
-    result = subprocess.run(["sh", config_path, arg_build, arg_prefix, arg_gmp,
-                             "--disable-shared", "--enable-static", "--with-piplib=no", "--with-clang=no"],
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error configuring ISL!")
-        with open("config_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-
-    cpu_cores = str(run_nproc())
-    print("Building ISL...")
-    result = subprocess.run(["make", "-j", cpu_cores], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error building ISL!")
-        with open("build_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-    print("Installing ISL...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error installing ISL!")
-        with open("install_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-
-    restore_env(old_env)
-    os.chdir(WORK_FOLDER)
-    return prefix
+    return build_host_library("isl", source_folder, build_folder, system_type, ["--with-gmp-prefix=" + gmp_prefix])
 
 
 def build_cloog(source_folder, build_folder, system_type, gmp_prefix):
@@ -1187,263 +1771,154 @@ def build_cloog(source_folder, build_folder, system_type, gmp_prefix):
     :param gmp_prefix: string as returned by build_gmp()
     :return: cloog_prefix on success, None when failed
     """
-    global WORK_FOLDER, LOCATIONS
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
-    abs_build = os.path.abspath(build_folder)
-    abs_pkg = os.path.abspath(LOCATIONS["pkg_dir"])
-    build_common = os.path.join(abs_build, "cloog")
-    config_path = os.path.join(abs_source, "configure")
-    uname_info = os.uname()
-    prefix = os.path.join(abs_pkg, "cloog", "cloog-" + uname_info.machine)
-    # purge build folder
-    if os.path.exists(build_common):
-        rmtree(build_common)
-    os.makedirs(build_common)
-    os.chdir(build_common)
-    arg_build = "--build=" + system_type
-    arg_prefix = "--prefix=" + prefix
-    arg_gmp = '--with-gmp-prefix=' + gmp_prefix
-    old_env = None
-    if "64" in uname_info.machine:
-        old_env = set_env()
-    else:
-        old_env = set_env(False)
-    print("Configuring CLoog...")
-    result = subprocess.run(["sh", config_path, arg_build, arg_prefix, arg_gmp,
-                             "--disable-shared", "--enable-static", "--with-bits=gmp", "--with-isl=bundled"],
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error configuring cloog!")
-        with open("config_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-
-    cpu_cores = str(run_nproc())
-    print("Building CLoog...")
-    result = subprocess.run(["make", "-j", cpu_cores], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error building cloog!")
-        with open("build_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-    print("Installing CLoog...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error installing cloog!")
-        with open("install_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-
-    restore_env(old_env)
-    os.chdir(WORK_FOLDER)
-    return prefix
+    return build_host_library("cloog", source_folder, build_folder, system_type,
+                              ["--with-gmp-prefix=" + gmp_prefix])
 
 
 def build_mpc(source_folder, build_folder, system_type, gmp_prefix, mpfr_prefix):
     """
-    Build ISL library. Depends on GMP and MPFR.
-    :param source_folder: Source folder of ISL
+    Build MPC library. Depends on GMP and MPFR.
+    :param source_folder: Source folder of MPC
     :param build_folder: Build folder
     :param system_type: string as returned by guess_config()
     :param gmp_prefix: string as returned by build_gmp()
     :param mpfr_prefix: string as returned by build_mpfr()
     :return: mpc_prefix on success, None when failed
     """
-    global WORK_FOLDER, LOCATIONS
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
-    abs_build = os.path.abspath(build_folder)
-    abs_pkg = os.path.abspath(LOCATIONS["pkg_dir"])
-    build_common = os.path.join(abs_build, "mpc")
-    config_path = os.path.join(abs_source, "configure")
-    uname_info = os.uname()
-    prefix = os.path.join(abs_pkg, "mpc", "mpc-" + uname_info.machine)
-    # purge build folder
-    if os.path.exists(build_common):
-        rmtree(build_common)
-    os.makedirs(build_common)
-    os.chdir(build_common)
-    arg_build = "--build=" + system_type
-    arg_prefix = "--prefix=" + prefix
-    arg_gmp = '--with-gmp=' + gmp_prefix
-    arg_mpfr = '--with-mpfr=' + mpfr_prefix
-    old_env = None
-    if "64" in uname_info.machine:
-        old_env = set_env()
-    else:
-        old_env = set_env(False)
-    print("Configuring MPC...")
-    result = subprocess.run(["sh", config_path, arg_build, arg_prefix, arg_gmp, arg_mpfr,
-                             "--disable-shared", "--enable-static"],
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error configuring MPC!")
-        with open("config_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
+    return build_host_library("mpc", source_folder, build_folder, system_type,
+                              ["--with-gmp=" + gmp_prefix, "--with-mpfr=" + mpfr_prefix])
 
-    cpu_cores = str(run_nproc())
-    print("Building MPC...")
-    result = subprocess.run(["make", "-j", cpu_cores], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error building MPC!")
-        with open("build_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
-    print("Installing MPC...")
-    result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if result.returncode:
-        print("Error installing MPC!")
-        with open("install_error.log", "w") as f:
-            message = result.stdout.decode("utf-8")
-            f.write(message)
-            message = result.stderr.decode("utf-8")
-            f.write(message)
-        restore_env(old_env)
-        return None
 
-    restore_env(old_env)
-    os.chdir(WORK_FOLDER)
-    return prefix
+@contextlib.contextmanager
+def timed_stage(counter):
+    """
+    Record the wall clock time spent in a with block in PERFORMANCE_COUNTER. Safe to use from a thread.
+    perf_counter() is monotonic, so clock adjustments during a long build do not skew it.
+    :param counter: key in PERFORMANCE_COUNTER, set to the elapsed seconds as a float
+    :return: context manager
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PERFORMANCE_COUNTER[counter] = time.perf_counter() - start
+
+
+def timed_build(counter, build, *args):
+    """
+    Run a build function with its time recorded by timed_stage(). Safe to run from a thread.
+    :param counter: key in PERFORMANCE_COUNTER
+    :param build: build function
+    :param args: arguments for build
+    :return: whatever build returns
+    """
+    with timed_stage(counter):
+        return build(*args)
 
 
-def build_gcc1(source_folder, build_folder, system_type, gmp_prefix, mpfr_prefix,
-               isl_prefix, mpc_prefix):
+def build_host_libraries(source_folders, build_folder, system_type):
     """
-    Build GCC step 1 of 2. Depends on GMP, MPFR, ISL and MPC
+    Build GMP, MPFR, ISL, CLoog and MPC. GMP goes first, MPFR, ISL and CLoog only need GMP
+    and build side by side, and MPC starts as soon as MPFR is installed.
+    :param source_folders: dict of component name to source folder
+    :param build_folder: Build folder
+    :param system_type: string as returned by guess_config()
+    :return: dict of library name to install prefix on success, None when failed
+    """
+    prefixes = {"gmp": timed_build("GMP", build_gmp, source_folders["gmp"], build_folder, system_type)}
+    if not prefixes["gmp"]:
+        print_error("Failed to build GMP. Build process terminated.")
+        return None
+    print_ok("Built GMP")
+
+    counters = {"mpfr": "MPFR", "isl": "ISL", "cloog": "cloog", "mpc": "MPC"}
+    with ThreadPoolExecutor(max_workers=len(counters)) as executor:
+        futures = {name: executor.submit(timed_build, counters[name], build, source_folders[name], build_folder,
+                                         system_type, prefixes["gmp"])
+                   for name, build in (("mpfr", build_mpfr), ("isl", build_isl), ("cloog", build_cloog))}
+        prefixes["mpfr"] = futures["mpfr"].result()
+        if prefixes["mpfr"]:
+            futures["mpc"] = executor.submit(timed_build, "MPC", build_mpc, source_folders["mpc"], build_folder,
+                                             system_type, prefixes["gmp"], prefixes["mpfr"])
+        for name, future in futures.items():
+            prefixes[name] = future.result()
+    for name, counter in counters.items():
+        if not prefixes.get(name):
+            print_error("Failed to build " + counter + ". Build process terminated.")
+            return None
+        print_ok("Built " + counter)
+    return prefixes
+
+
+def build_gcc1(source_folder, build_folder, system_type, host_prefixes):
+    """
+    Build GCC step 1 of 2. Depends on GMP, MPFR, ISL and MPC, which both targets share
     :param source_folder: source folder of GCC
     :param build_folder: folder to hold building files
     :param system_type: string as returned by guess_config()
-    :param gmp_prefix: string as returned by build_gmp()
-    :param mpfr_prefix: string as returned by build_mpfr()
-    :param isl_prefix: string as returned by build_isl()
-    :param mpc_prefix: string as returned by build_mpc()
-    :return: tuple of build_paths on success, (None,None) when failed
+    :param host_prefixes: dict as returned by build_host_libraries()
+    :return: tuple of build_paths on success, None when failed
     """
-    global WORK_FOLDER, LOCATIONS, TARGET, USE_SJLJ
-
     build_target = ["i686", "x86_64"]
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
+    abs_source = os.path.abspath(os.path.join(WORK_FOLDER, source_folder))
     config_path = os.path.join(abs_source, "configure")
-    abs_build_common = os.path.join(os.path.abspath(build_folder), "gcc")
+    abs_build_common = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, build_folder)), "gcc")
 
     build_paths = {
         "i686": os.path.join(abs_build_common, "i686"),
         "x86_64": os.path.join(abs_build_common, "x86_64")
     }
 
-    abs_prefix = {
-        "i686": os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"]),
-        "x86_64": os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    }
-    arg_mpc = '--with-mpc=' + mpc_prefix
-    arg_mpfr = '--with-mpfr=' + mpfr_prefix
-    arg_gmp = '--with-gmp=' + gmp_prefix
-    arg_isl = '--with-isl=' + isl_prefix
+    arg_mpc = '--with-mpc=' + host_prefixes["mpc"]
+    arg_mpfr = '--with-mpfr=' + host_prefixes["mpfr"]
+    arg_gmp = '--with-gmp=' + host_prefixes["gmp"]
+    arg_isl = '--with-isl=' + host_prefixes["isl"]
     arg_build = "--build=" + system_type
 
     # purge old build files
-    if os.path.exists(abs_build_common):
-        rmtree(abs_build_common)
+    purge_folder(abs_build_common)
     os.makedirs(build_paths["i686"])
     os.makedirs(build_paths["x86_64"])
 
-    for target in build_target:
-        os.chdir(build_paths[target])
-        print("Configuring GCC (1 of 2) ", target, "...")
-        arg_target = "--target=" + TARGET[target]
-        arg_prefix = '--prefix=' + abs_prefix[target]
-        arg_sysroot = '--with-sysroot=' + abs_prefix[target]
-        arg_sjlj = ""
-        if USE_SJLJ and (target == "i686"):
-            arg_sjlj += "--enable-sjlj-exceptions"
-        else:
-            arg_sjlj += "--disable-sjlj-exceptions"
-
-        print("Configuring GCC ", target, "...")
-
-        result = subprocess.run(["sh", config_path, arg_build, arg_target, arg_prefix, arg_sysroot,
-                                  "--enable-static", "--disable-shared", "--disable-nls",
-                                  "--disable-multilib", '--enable-languages=c,c++', "--enable-lto",
-                                  "--enable-fully-dynamic-string", "--enable-threads=posix", arg_sjlj,
-                                  arg_mpc, arg_mpfr, arg_isl, arg_mpc, arg_gmp],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to configure GCC (1 of 2) ", TARGET[target])
-            with open("config_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None, None
-        # actual build
-        cpu_count = str(run_nproc())
-        print("Building GCC (1 of 2) ", target, "...")
-
-        result = subprocess.run(["make", "-j", cpu_count, "all-gcc"],
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # result = None
-        # result = subprocess.Popen(["make", "-j", cpu_count, "all-gcc"],
-        #                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        #
-        # while result.poll() is None:
-        #     print('.')
-        #     time.sleep(10)
+    env = with_host_ccache(dict(os.environ))
+    with ThreadPoolExecutor(max_workers=len(build_target)) as executor:
+        futures = []
+        for target in build_target:
+            arg_target = "--target=" + TARGET[target]
+            arg_prefix = '--prefix=' + PREFIXES[target]
+            arg_sysroot = '--with-sysroot=' + PREFIXES[target]
+            arg_sjlj = ""
+            if USE_SJLJ and (target == "i686"):
+                arg_sjlj += "--enable-sjlj-exceptions"
+            else:
+                arg_sjlj += "--disable-sjlj-exceptions"
+            configure_command = ["sh", config_path, arg_build, arg_target, arg_prefix, arg_sysroot,
+                                 "--enable-static", "--disable-shared", "--disable-nls", "--disable-bootstrap",
+                                 "--disable-multilib", '--enable-languages=c,c++', "--enable-lto",
+                                 "--enable-fully-dynamic-string", "--enable-threads=posix", arg_sjlj,
+                                 arg_mpc, arg_mpfr, arg_isl, arg_gmp]
+            futures.append(executor.submit(build_gcc1_arch, target, configure_command, build_paths[target],
+                                           env))
+        results = [future.result() for future in futures]
+    if not all(results):
+        return None
+    return build_paths["i686"], build_paths["x86_64"]
 
-        if result.returncode:
-            print_error()
-            print("Failed to build GCC (1 of 2) ", TARGET[target])
-            with open("build_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None, None
-        # Install GCC
-        print("Installing GCC (1 of 2) ", target, "...")
-        result = subprocess.run(["make", "install-gcc"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to install GCC (1 of 2) ", TARGET[target])
-            with open("install_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None, None
 
-    os.chdir(WORK_FOLDER)
-    return build_paths["i686"], build_paths["x86_64"]
+def build_gcc1_arch(target, configure_command, build_path, env):
+    """
+    Configure, build and install GCC step 1 for one target.
+    :param target: "i686" or "x86_64"
+    :param configure_command: argument list for running GCC's configure script
+    :param build_path: Empty folder for this build
+    :param env: Environment variables for the build
+    :return: None if failed. True if success.
+    """
+    return run_build_steps("GCC (1 of 2) " + TARGET[target], [
+        ("configure", configure_command, "configure.log"),
+        ("build", make_args("all-gcc"), "build.log"),
+        ("install", make_args("install-gcc"), "install.log")
+    ], cwd=build_path, env=env)
 
 
 def build_crt(source_folder, build_folder, system_type):
@@ -1454,117 +1929,86 @@ def build_crt(source_folder, build_folder, system_type):
     :param system_type: string as returned by guess_config()
     :return: True when success. None when failed.
     """
-    global WORK_FOLDER, LOCATIONS, TARGET
-
     build_target = ["i686", "x86_64"]
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
+    abs_source = os.path.abspath(os.path.join(WORK_FOLDER, source_folder))
     config_path = os.path.join(abs_source, "mingw-w64-crt", "configure")
-    abs_build_common = os.path.join(os.path.abspath(build_folder), "crt")
+    abs_build_common = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, build_folder)), "crt")
 
     build_paths = {
         "i686": os.path.join(abs_build_common, "i686"),
         "x86_64": os.path.join(abs_build_common, "x86_64")
     }
 
-    abs_prefix = {
-        "i686": os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"]),
-        "x86_64": os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    }
-
-    path_var ={
-        "i686": os.path.join(os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"]), "bin")+":"+os.environ["PATH"],
-        "x86_64": os.path.join(os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"]), "bin")+":"+os.environ["PATH"],
-        "original": os.environ["PATH"]
-    }
-
-    cc_var ={
-        "i686": "i686-w64-mingw32-gcc",
-        "x86_64": "x86_64-w64-mingw32-gcc",
-        "original": os.environ["CC"]
+    # I cannot find where zeranoe set the PATH in his script, but this should be essential for CRT building
+    env = {
+        "i686": with_ccache(dict(os.environ,
+                                 PATH=PREFIX_BINS["i686"] + ":" + ORIGINAL_PATH),
+                            "i686-w64-mingw32-gcc"),
+        "x86_64": with_ccache(dict(os.environ,
+                                   PATH=PREFIX_BINS["x86_64"] + ":" + ORIGINAL_PATH),
+                              "x86_64-w64-mingw32-gcc")
     }
 
     arg_build = "--build=" + system_type
 
     # purge old build files
-    if os.path.exists(abs_build_common):
-        rmtree(abs_build_common)
+    purge_folder(abs_build_common)
     os.makedirs(build_paths["i686"])
     os.makedirs(build_paths["x86_64"])
 
-    for t in build_target:
-        os.chdir(build_paths[t])
-        arg_host = "--host=" + TARGET[t]
-        arg_prefix = '--prefix=' + abs_prefix[t]
-        arg_sysroot = '--with-sysroot=' + abs_prefix[t]
-        # I cannot find where zeranoe set the PATH in his script, but this should be essential for CRT building
-        print("Setting PATH and CC...")
-        os.environ["PATH"] = path_var[t]
-        os.environ["CC"] = cc_var[t]
-
-        print("Configuring Mingw-w64 CRT ", t, "...")
-        result = subprocess.run(["sh", config_path, arg_build, arg_host, arg_prefix, arg_sysroot],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Error configuring Mingw-w64 CRT", t)
-            with open("config_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-                return None
-        # actual build
-        cpu_count = str(run_nproc())
-        print("Building Mingw-w64 CRT", t, "...")
-
-        result = subprocess.run(["make", "-j", cpu_count], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # result = None
-        # result = subprocess.Popen(["make", "-j", cpu_count], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # while result.poll() is None:
-        #     print('.')
-        #     time.sleep(10)
-        # print('')
-        if result.returncode:
-            print_error()
-            print("Error building Mingw-w64 CRT", t)
-            with open("build_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-                return None
-        # install
-        print("Installing Mingw-w64 CRT", t, "...")
-        result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Error installing Mingw-w64 CRT", t)
-            with open("install_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-                return None
-        # a mysterious rename operation
-        # is this necessary?
-        print("Performing folder rename for unknown purpose... :-/")
-        os.chdir(abs_prefix[t])
-        from_folder = os.path.abspath(os.path.join("./", TARGET[t], "lib"))
-        to_folder = os.path.abspath(os.path.join("./", "lib"))
-        move(from_folder, to_folder)
-        #rmtree(from_folder) # if moved sucessfully, the original is gone...
-        #actually why not just make symlink in the top folder???
-        os.chdir(os.path.join("./", TARGET[t]))
-        if not os.path.exists("./lib"):
-            os.symlink("../lib", "./lib")
-        # if not os.path.exists(to_folder):
-        #     os.symlink(from_folder, to_folder)
+    with ThreadPoolExecutor(max_workers=len(build_target)) as executor:
+        futures = [executor.submit(build_crt_arch, t, config_path, build_paths[t], PREFIXES[t], arg_build,
+                                   env[t])
+                   for t in build_target]
+        results = [future.result() for future in futures]
+    if not all(results):
+        return None
+    return True
 
-        os.chdir(WORK_FOLDER)
-        # restore PATH
-        os.environ["PATH"] = path_var["original"]
-        os.environ["CC"] = cc_var["original"]
+
+def build_crt_arch(t, config_path, build_path, prefix, arg_build, env):
+    """
+    Configure, build and install mingw-w64 CRT for one target.
+    :param t: "i686" or "x86_64"
+    :param config_path: Path to the configure script of mingw-w64-crt
+    :param build_path: Empty folder for this build
+    :param prefix: Install prefix, also used as sysroot
+    :param arg_build: --build argument for configure
+    :param env: Environment variables for the build, with PATH and CC set for the Mingw-w64 compiler
+    :return: True when success. None when failed.
+    """
+    arg_host = "--host=" + TARGET[t]
+    arg_prefix = '--prefix=' + prefix
+    arg_sysroot = '--with-sysroot=' + prefix
+
+    if not run_build_steps("Mingw-w64 CRT " + t, [
+        ("configure", ["sh", config_path, arg_build, arg_host, arg_prefix, arg_sysroot], "configure.log"),
+        ("build", make_args(), "build.log"),
+        ("install", make_args("install"), "install.log")
+    ], cwd=build_path, env=env):
+        return None
+    # a mysterious rename operation
+    # is this necessary?
+    print("Performing folder rename for unknown purpose... :-/")
+    from_folder = os.path.join(prefix, TARGET[t], "lib")
+    to_folder = os.path.join(prefix, "lib")
+    if os.path.isdir(to_folder):  # like move(), put it inside an existing folder
+        to_folder = os.path.join(to_folder, "lib")
+    try:
+        os.rename(from_folder, to_folder)  # same file system, nothing is copied
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        move(from_folder, to_folder)
+    #rmtree(from_folder) # if moved sucessfully, the original is gone...
+    #actually why not just make symlink in the top folder???
+    lib_link = os.path.join(prefix, TARGET[t], "lib")
+    try:
+        os.symlink("../lib", lib_link)
+    except FileExistsError:
+        pass
+    # if not os.path.exists(to_folder):
+    #     os.symlink(from_folder, to_folder)
     return True
 
 
@@ -1574,79 +2018,19 @@ def build_gcc2(build_folder):
     :param build_folder: Use the returned tuple from build_gcc1()
     :return: True on success. None on failure.
     """
-    global WORK_FOLDER
-
-    os.chdir(WORK_FOLDER)
-    cpu_cores = str(run_nproc())
+    env = with_host_ccache(dict(os.environ))  # as in build_gcc1(), whose configure recorded these compilers
     for folder in build_folder:
-        os.chdir(folder)
-        print("Building libGCC in ", folder, "...")
-        result = subprocess.run(["make", "-j", cpu_cores, "all-target-libgcc"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # result = None
-        # result = subprocess.Popen(["make", "-j", cpu_cores, "all-target-libgcc"],
-        #                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # while result.poll() is None:
-        #     print('.')
-        #     time.sleep(10)
-        print('')
-        if result.returncode:
-            print_error()
-            print("Error building libGCC!")
-            with open("build_error_libgcc.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
-
-        print("Installing libGCC...")
-        result = subprocess.run(["make", "install-target-libgcc"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        if result.returncode:
-            print_error()
-            print("Error installing libGCC!")
-            with open("install_error_libgcc.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
+        folder = os.path.join(WORK_FOLDER, folder)
+        if not run_build_steps("libGCC in " + folder, [
+            ("build", make_args("all-target-libgcc"), "build_libgcc.log"),
+            ("install", make_args("install-target-libgcc"), "install_libgcc.log")
+        ], cwd=folder, env=env):
             return None
-
-        print("Building GCC in ", folder, "...")
-        result = subprocess.run(["make", "-j", cpu_cores], stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        # result = None
-        # result = subprocess.Popen(["make", "-j", cpu_cores], stdout=subprocess.PIPE,
-        #                           stderr=subprocess.PIPE)
-        # while result.poll() is None:
-        #     print('.')
-        #     time.sleep(10)
-        # print('')
-        if result.returncode:
-            print_error()
-            print("Error building GCC!")
-            with open("build_error_gcc.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
-
-        print("Installing GCC...")
-        result = subprocess.run(["make", "install-strip"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        if result.returncode:
-            print_error()
-            print("Error installing GCC!")
-            with open("install_error_gcc.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
+        if not run_build_steps("GCC in " + folder, [
+            ("build", make_args(), "build_gcc.log"),
+            ("install", make_args("install-strip"), "install_gcc.log")
+        ], cwd=folder, env=env):
             return None
-
-        os.chdir(WORK_FOLDER)
     return True
 
 
@@ -1658,171 +2042,109 @@ def build_winpthreads(source_folder, build_folder, system_type):
     :param system_type: string as returned by guess_config()
     :return: True on success. None on failure.
     """
-    global WORK_FOLDER, LOCATIONS, TARGET
-    os.chdir(WORK_FOLDER)
-    config_source = os.path.join(os.path.abspath(source_folder), "mingw-w64-libraries/winpthreads/configure")
-    build_common = os.path.join(os.path.abspath(build_folder), "winpthreads")
-    abs_prefix ={
-        "i686": os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"]),
-        "x86_64": os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    }
+    config_source = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, source_folder)),
+                                 "mingw-w64-libraries/winpthreads/configure")
+    build_common = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, build_folder)), "winpthreads")
     path_var = {
-        "i686": os.path.join(os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"]), "bin") + ":" + os.environ["PATH"],
-        "x86_64": os.path.join(os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"]), "bin") + ":" + os.environ["PATH"],
-        "original": os.environ["PATH"]
+        "i686": PREFIX_BINS["i686"] + ":" + ORIGINAL_PATH,
+        "x86_64": PREFIX_BINS["x86_64"] + ":" + ORIGINAL_PATH
     }
 
     cc_var = {
         "i686": "i686-w64-mingw32-gcc",
-        "x86_64": "x86_64-w64-mingw32-gcc",
-        "original": os.environ["CC"]
+        "x86_64": "x86_64-w64-mingw32-gcc"
     }
+    if not os.path.exists(config_source):
+        print_error("winpthreads' configure script is not found!")
+        return None
     # Reset the build folder
-    if os.path.exists(build_common):
-        rmtree(build_common)
+    purge_folder(build_common)
     os.makedirs(build_common)
-    # Architectures to loop through
+    # Architectures to build side by side
     archs = ["i686", "x86_64"]
-    # Loop and build
-    for arch in archs:
-        arch_build_folder = os.path.join(build_common, arch)
-        os.makedirs(arch_build_folder)
-        os.chdir(arch_build_folder)
-        if not os.path.exists(config_source):
-            print_error()
-            print("winpthreads' configure script is not found!")
-            return None
-        arg_build = "--build=" + system_type
-        arg_host = "--host=" + TARGET[arch]
-        arg_prefix = "--prefix=" + abs_prefix[arch]
-        # Set PATH and CC
-        print("Setting PATH and CC...")
-        os.environ["PATH"] = path_var[arch]
-        os.environ["CC"] = cc_var[arch]
-
-        # Run configure
-        print("Configuring winpthreads ", arch, "...")
-        result = subprocess.run(["sh", config_source, arg_build, arg_host, arg_prefix,
-                                 "--enable-static", "--disable-shared"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to configure winpthreads ", arch)
-            with open("config_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
-
-        # Run Make
-        print("Building winpthreads ", arch, "...")
-        result = subprocess.run(["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to build winpthreads ", arch)
-            with open("build_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
+    arg_build = "--build=" + system_type
+    with ThreadPoolExecutor(max_workers=len(archs)) as executor:
+        futures = []
+        for arch in archs:
+            arch_build_folder = os.path.join(build_common, arch)
+            os.makedirs(arch_build_folder)
+            # PATH and CC for the Mingw-w64 compiler, our own environment is left alone
+            env = with_ccache(dict(os.environ, PATH=path_var[arch]), cc_var[arch])
+            futures.append(executor.submit(build_winpthreads_arch, arch, config_source, arch_build_folder,
+                                           PREFIXES[arch], arg_build, env))
+        results = [future.result() for future in futures]
+    if not all(results):
+        return None
+    return True
 
-        # Install
-        print("Installing winpthreads ", arch, "...")
-        result = subprocess.run(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to install winpthreads ", arch)
-            with open("install_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
 
-        os.environ["PATH"] = path_var["original"]
-        os.environ["CC"] = cc_var["original"]
-        os.chdir(WORK_FOLDER)
-    return True
+def build_winpthreads_arch(arch, config_source, build_path, prefix, arg_build, env):
+    """
+    Configure, build and install winpthreads for one target.
+    :param arch: "i686" or "x86_64"
+    :param config_source: Path to the configure script of winpthreads
+    :param build_path: Empty folder for this build
+    :param prefix: Install prefix
+    :param arg_build: --build argument for configure
+    :param env: Environment variables for the build, with PATH and CC set for the Mingw-w64 compiler
+    :return: True on success. None on failure.
+    """
+    arg_host = "--host=" + TARGET[arch]
+    arg_prefix = "--prefix=" + prefix
+    return run_build_steps("winpthreads " + arch, [
+        ("configure", ["sh", config_source, arg_build, arg_host, arg_prefix,
+                       "--enable-static", "--disable-shared"], "configure.log"),
+        ("build", make_args(), "build.log"),
+        ("install", make_args("install"), "install.log")
+    ], cwd=build_path, env=env)
 
 
 def build_pkgconf(source_folder, build_folder, system_type):
-    global WORK_FOLDER, LOCATIONS, TARGET, USE_SJLJ
-
     build_target = ["i686", "x86_64"]
-    os.chdir(WORK_FOLDER)
-    abs_source = os.path.abspath(source_folder)
+    abs_source = os.path.abspath(os.path.join(WORK_FOLDER, source_folder))
     config_path = os.path.join(abs_source, "configure")
-    abs_build_common = os.path.join(os.path.abspath(build_folder), "pkgconf")
+    abs_build_common = os.path.join(os.path.abspath(os.path.join(WORK_FOLDER, build_folder)), "pkgconf")
 
     build_paths = {
         "i686": os.path.join(abs_build_common, "i686"),
         "x86_64": os.path.join(abs_build_common, "x86_64")
     }
 
-    abs_prefix = {
-        "i686": os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"]),
-        "x86_64": os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    }
-
     # purge old build files
-    if os.path.exists(abs_build_common):
-        rmtree(abs_build_common)
+    purge_folder(abs_build_common)
     os.makedirs(build_paths["i686"])
     os.makedirs(build_paths["x86_64"])
     for target in build_target:
-        os.chdir(build_paths[target])
-        print("Configuring pkgconf ", target, "...")
-        arg_prefix = "--prefix="+ abs_prefix[target]
-        arg_libdir = "--with-system-libdir=" + os.path.join(abs_prefix[target], "lib")
-        arg_inc = "--with-system-includedir=" + os.path.join(abs_prefix[target], "include")
-        result = subprocess.run(["sh", config_path, arg_prefix, arg_libdir, arg_inc],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to configure pkgconf ", TARGET[target])
-            with open("config_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
+        arg_prefix = "--prefix="+ PREFIXES[target]
+        arg_libdir = "--with-system-libdir=" + os.path.join(PREFIXES[target], "lib")
+        arg_inc = "--with-system-includedir=" + os.path.join(PREFIXES[target], "include")
+        if not run_build_steps("pkgconf " + TARGET[target], [
+            ("configure", ["sh", config_path, arg_prefix, arg_libdir, arg_inc], "configure.log"),
+            ("build", make_args(), "build.log"),
+            ("install", make_args("install"), "install.log")
+        ], cwd=build_paths[target]):
             return None
-        cpu_count = str(run_nproc())
-        print("Building pkgconf ", target, "...")
+        try:
+            os.symlink("pkgconf", os.path.join(PREFIX_BINS[target], "pkg-config"))
+        except FileExistsError:
+            pass
+    return True
 
-        result = subprocess.run(["make", "-j", cpu_count],
-                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # while result.poll() is None:
-        #     print('.')
-        #     time.sleep(10)
 
-        if result.returncode:
-            print_error()
-            print("Failed to build pkgconf ", TARGET[target])
-            with open("build_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
-        # Install GCC
-        print("Installing pkgconf ", target, "...")
-        result = subprocess.run(["make", "install"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode:
-            print_error()
-            print("Failed to install pkgconf ", TARGET[target])
-            with open("install_error.log", "w") as f:
-                message = result.stdout.decode("utf-8")
-                f.write(message)
-                message = result.stderr.decode("utf-8")
-                f.write(message)
-            return None
-        os.chdir(os.path.join(abs_prefix[target],"bin"))
-        os.symlink("pkgconf", "pkg-config")
-    os.chdir(WORK_FOLDER)
-    return True
+def write_script(path, content):
+    """
+    Write a shell script that is executable by everyone, in one open() instead of a later stat() and chmod().
+    The script is encoded once and written straight to the descriptor, without a text file object around it.
+    :param path: path of the script, overwritten if it exists
+    :param content: text of the script
+    :return: None
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o755)
+    try:
+        os.write(fd, content.encode("utf-8"))
+    finally:
+        os.close(fd)
+    return None
 
 
 def generate_documentation():
@@ -1830,16 +2152,14 @@ def generate_documentation():
     Generate readme and helper scripts
     :return: None
     """
-    global WORK_FOLDER, LOCATIONS, PERFORMANCE_COUNTER
     os.chdir(WORK_FOLDER)
-    current_time = datetime.datetime.utcnow().isoformat()
-    i686_prefix = os.path.abspath(LOCATIONS["mingw_w64_i686_prefix"])
-    x86_64_prefix = os.path.abspath(LOCATIONS["mingw_w64_x86_64_prefix"])
-    i686_bin = os.path.join(i686_prefix, "bin")
-    x86_64_bin = os.path.join(x86_64_prefix, "bin")
-    original_path = os.environ["PATH"]
+    current_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    i686_bin = PREFIX_BINS["i686"]
+    x86_64_bin = PREFIX_BINS["x86_64"]
+    original_path = ORIGINAL_PATH
     i686_new_path = i686_bin + ":" + original_path
     x86_64_new_path = x86_64_bin + ":" + original_path
+    minutes = {name: seconds / 60 for name, seconds in PERFORMANCE_COUNTER.items()}
     # Generate README
     readme_content = """\
     Mingw-w64 Toolchain built on {date}
@@ -1856,35 +2176,25 @@ def generate_documentation():
     
     Time consumed for building each component (in minutes)
     ===================================================================
-    Downloading: {t_dl}
-    Binutils: {t_binutils}
-    Mingw-w64 Headers: {t_header}
-    GMP: {t_gmp}
-    MPFR: {t_mpfr}
-    ISL: {t_isl}
-    CLoog: {t_cloog}
-    MPC: {t_mpc}
-    GCC Bootstrap compiler: {t_gcc1}
-    Mingw-w64 CRT: {t_crt}
-    GCC: {t_gcc2}
-    winpthreads: {t_winpthreads}
+    Downloading: {Download}
+    Binutils: {Binutils}
+    Mingw-w64 Headers: {Header}
+    GMP: {GMP}
+    MPFR: {MPFR}
+    ISL: {ISL}
+    CLoog: {cloog}
+    MPC: {MPC}
+    GCC Bootstrap compiler: {GCC1}
+    Mingw-w64 CRT: {CRT}
+    GCC: {GCC2}
+    winpthreads: {winpthreads}
+    pkgconf: {pkgconf}
     
     """.format(date=current_time, path32=i686_bin, path64=x86_64_bin, oldpath=original_path,
-               t_dl=PERFORMANCE_COUNTER["Download"].seconds/60,
-               t_binutils=PERFORMANCE_COUNTER["Binutils"].seconds/60,
-               t_header=PERFORMANCE_COUNTER["Header"].seconds/60,
-               t_gmp=PERFORMANCE_COUNTER["GMP"].seconds/60,
-               t_mpfr=PERFORMANCE_COUNTER["MPFR"].seconds/60,
-               t_isl=PERFORMANCE_COUNTER["ISL"].seconds/60,
-               t_cloog=PERFORMANCE_COUNTER["cloog"].seconds/60,
-               t_mpc=PERFORMANCE_COUNTER["MPC"].seconds/60,
-               t_gcc1=PERFORMANCE_COUNTER["GCC1"].seconds/60,
-               t_crt=PERFORMANCE_COUNTER["CRT"].seconds/60,
-               t_gcc2=PERFORMANCE_COUNTER["GCC2"].seconds/60,
-               t_winpthreads=PERFORMANCE_COUNTER["winpthreads"].seconds/60)
+               **minutes)  # the time placeholders are named after the PERFORMANCE_COUNTER keys
     print("Generating readme.txt")
-    with open("readme.txt", "w") as file:
-        file.write(readme_content)
+    with open("readme.txt", "wb") as file:
+        file.write(readme_content.encode("utf-8"))
     # Generate helper scripts
     print("Generating helper scripts")
     use_script_template = """\
@@ -1907,30 +2217,37 @@ def generate_documentation():
     printf "Original PATH restored\\n"
     """
 
-    with open("use32.sh", "w") as file:
-        file.write(use_script_template.format(new_path=i686_new_path, arch="i686"))
-    st = os.stat("use32.sh")
-    os.chmod("use32.sh", st.st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+    write_script("use32.sh", use_script_template.format(new_path=i686_new_path, arch="i686"))
     print("Use use32.sh to setup for 32bit toolchain\n")
 
-    with open("use64.sh", "w") as file:
-        file.write(use_script_template.format(new_path=x86_64_new_path, arch="x86_64"))
-    st = os.stat("use64.sh")
-    os.chmod("use64.sh", st.st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+    write_script("use64.sh", use_script_template.format(new_path=x86_64_new_path, arch="x86_64"))
     print("Use use64.sh to setup for 64bit toolchain\n")
 
-    with open("restore.sh", "w") as file:
-        file.write(restore_script_template.format(new_path=original_path))
-    st = os.stat("restore.sh")
-    os.chmod("restore.sh", st.st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    write_script("restore.sh", restore_script_template.format(new_path=original_path))
     print("Use restore.sh to restore the PATH variable\n")
     print("Done!")
     return None
 
 
+# Build stages in order: (PERFORMANCE_COUNTER key, description, build function, argument keys).
+# Argument keys name a source folder from download_all(), "source_folders", "build_dir", "system_type"
+# or the function name of an earlier stage to get its result.
+PIPELINE = [
+    ("Binutils", "Binutils", build_binutils, ("binutils", "build_dir", "system_type")),
+    ("Header", "mingw-w64 headers", build_mingw_header, ("mingw64", "build_dir", "system_type")),
+    ("Host libraries", "GMP, MPFR, ISL, CLoog and MPC", build_host_libraries,
+     ("source_folders", "build_dir", "system_type")),
+    ("GCC1", "GCC 1 of 2", build_gcc1, ("gcc", "build_dir", "system_type", "build_host_libraries")),
+    ("CRT", "CRT", build_crt, ("mingw64", "build_dir", "system_type")),
+    ("winpthreads", "winpthreads", build_winpthreads, ("mingw64", "build_dir", "system_type")),
+    ("GCC2", "GCC 2 of 2", build_gcc2, ("build_gcc1",)),
+    ("pkgconf", "pkgconf", build_pkgconf, ("pkgconf", "build_dir", "system_type")),
+]
+
+
 def main():
 
-    global WORK_FOLDER, LOCATIONS, PERFORMANCE_COUNTER
+    global WORK_FOLDER
 
     WORK_FOLDER = os.path.expandvars(WORK_FOLDER)
     WORK_FOLDER = os.path.expanduser(WORK_FOLDER)
@@ -1942,259 +2259,114 @@ def main():
         os.makedirs(WORK_FOLDER)
         os.chdir(WORK_FOLDER)
 
+    resolve_locations()
+    tmpfs_build = None
+    if USE_TMPFS:
+        tmpfs_build = tmpfs_build_folder()
+        if tmpfs_build:
+            print("Building in RAM: ", tmpfs_build)
+            LOCATIONS["mingw_w64_build_dir"] = tmpfs_build
+        else:
+            print("Not enough room on ", TMPFS_FOLDER, ", building in the sandbox")
     # purge target folders
-    if os.path.exists(os.path.join("./", LOCATIONS["mingw_w64_i686_prefix"])):
-        rmtree(os.path.join("./", LOCATIONS["mingw_w64_i686_prefix"]))
-    if os.path.exists(os.path.join("./", LOCATIONS["mingw_w64_x86_64_prefix"])):
-        rmtree(os.path.join("./", LOCATIONS["mingw_w64_x86_64_prefix"]))
+    purge_folder(LOCATIONS["mingw_w64_i686_prefix"])
+    purge_folder(LOCATIONS["mingw_w64_x86_64_prefix"])
 
     for item, path in LOCATIONS.items():
-        ex_path = os.path.expandvars(path)
-        ex_path = os.path.expanduser(ex_path)
-        ex_path = os.path.abspath(ex_path)
-        if not os.path.exists(ex_path):
-            print("Creating: ", ex_path)
-            os.makedirs(ex_path)
+        if not os.path.exists(path):
+            print("Creating: ", path)
+            os.makedirs(path)
     SYSTEM_TYPE = guess_config()
-    timer1 = datetime.datetime.utcnow()
-    if __name__ == "__main__":
-        thread_pool = mp.Pool(processes=2)
-        thread_pool.map(ftp_get_by_component, FTP_DOWNLOADS)
-
-        print("Downloaded from FTP")
-
-        thread_pool.map(html_get_by_component, HTML_DOWNLOADS)
-        thread_pool.close()
-        thread_pool.join()
-        print("Downloaded from HTTP")
-
-    # Retrieve extracted folder path
-    source_folders = {}
-    all_components = ["binutils", "gcc", "gmp", "mpfr", "mpc", "isl", "cloog", "mingw-w64", "pkgconf"]
-    with os.scandir(LOCATIONS["pkg_dir"]) as it:
-        for entry in it:
-            if not entry.is_dir():
-                continue
-            for component in all_components:
-                if component in entry.name:
-                    source_folders[component] = entry.path
-    print(source_folders)
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["Download"] = timer2 - timer1
-
-    # build binutils
-    timer1 = datetime.datetime.utcnow()
-    state = build_binutils(source_folders["binutils"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE)
-    if not state:
-        print_error()
-        print("Failed to build Binutils. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built Binutils")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["Binutils"] = timer2 - timer1
-
-    # build mingw headers
-    timer1 = datetime.datetime.utcnow()
-    state = build_mingw_header(source_folders["mingw-w64"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE)
-    if not state:
-        print_error()
-        print("Failed to build mingw-w64 headers. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built mingw-w64 headers")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["Header"] = timer2 - timer1
-
-    # build gmp
-    timer1 = datetime.datetime.utcnow()
-    gmp_prefix = build_gmp(source_folders["gmp"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE)
-    if not gmp_prefix:
-        print_error()
-        print("Failed to build GMP. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built GMP")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["GMP"] = timer2 - timer1
-
-    # build mpfr
-    timer1 = datetime.datetime.utcnow()
-    mpfr_prefix = build_mpfr(source_folders["mpfr"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE, gmp_prefix)
-    if not mpfr_prefix:
-        print_error()
-        print("Failed to build MPFR. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built MPFR")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["MPFR"] = timer2 - timer1
-
-    # build isl
-    timer1 = datetime.datetime.utcnow()
-    isl_prefix = build_isl(source_folders["isl"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE, gmp_prefix)
-    if not isl_prefix:
-        print_error()
-        print("Failed to build ISL. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built ISL")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["ISL"] = timer2 -timer1
-
-    # build cloog
-    timer1 = datetime.datetime.utcnow()
-    cloog_prefix = build_cloog(source_folders["cloog"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE, gmp_prefix)
-    if not cloog_prefix:
-        print_error()
-        print("Failed to build cloog. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built cloog")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["cloog"] = timer2 - timer1
-
-    # build mpc
-    timer1 = datetime.datetime.utcnow()
-    mpc_prefix = build_mpc(source_folders["mpc"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE,
-                           gmp_prefix, mpfr_prefix)
-    if not mpc_prefix:
-        print_error()
-        print("Failed to build mpc. Build process terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built mpc")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["MPC"] = timer2 - timer1
-
-    # build gcc1
-    timer1 = datetime.datetime.utcnow()
-    path32, path64 = build_gcc1(source_folders["gcc"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE,
-                                gmp_prefix, mpfr_prefix, isl_prefix, mpc_prefix)
-    if not path32:
-        print_error()
-        print("Failed to build GCC 1 of 2. Build terminated.")
-        return False
-    else:
-        print_ok()
-        print("GCC 1 of 2")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["GCC1"] = timer2 - timer1
-
-    # build crt
-    timer1 = datetime.datetime.utcnow()
-    state = build_crt(source_folders["mingw-w64"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE)
-    if not state:
-        print_error()
-        print("Failed to build CRT. Build terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built CRT")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["CRT"] = timer2 - timer1
-
-    # build winpthreads
-    timer1 = datetime.datetime.utcnow()
-    state = build_winpthreads(source_folders["mingw-w64"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE)
-    if not state:
-        print_error()
-        print("Failed to build winpthreads. Build terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built winpthreads")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["winpthreads"] = timer2 - timer1
-
-    # build GCC 2 of 2
-    timer1 = datetime.datetime.utcnow()
-    state = build_gcc2([path32, path64])
-    if not state:
-        print_error()
-        print("Failed to build GCC 2 of 2. Build terminated.")
-        return False
-    else:
-        print_ok()
-        print("GCC 2 of 2")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["GCC2"] = timer2 - timer1
-
-    # build pkgconf
-    timer1 = datetime.datetime.utcnow()
-    state = build_pkgconf(source_folders["pkgconf"], LOCATIONS["mingw_w64_build_dir"], SYSTEM_TYPE)
-    if not state:
-        print_error()
-        print("Failed to pkgconf. Build terminated.")
-        return False
-    else:
-        print_ok()
-        print("Built pkgconf")
-    timer2 = datetime.datetime.utcnow()
-    PERFORMANCE_COUNTER["pkgconf"] = timer2 - timer1
+    with timed_stage("Download"):
+        source_folders = download_all()
+        print("Downloaded from FTP and HTTP")
+        print(source_folders)
+        missing = [component for component, folder in source_folders.items() if not folder]
+        if missing:
+            print("Failed to download: ", ", ".join(missing))
+            return False
+
+    # build every component in order, each stage's result is kept under its function name for later stages
+    context = dict(source_folders, source_folders=source_folders,
+                   build_dir=LOCATIONS["mingw_w64_build_dir"], system_type=SYSTEM_TYPE)
+    for counter, description, build, arg_keys in PIPELINE:
+        with timed_stage(counter):
+            result = build(*[context[key] for key in arg_keys])
+        if not result:
+            print_error("Failed to build " + description + ". Build terminated.")
+            if tmpfs_build:
+                print("The build folder and its logs are kept in RAM at ", tmpfs_build, ", delete it when done")
+            return False
+        print_ok("Built " + description)
+        context[build.__name__] = result
+
     # Generate readme and helper scripts
     generate_documentation()
+    if tmpfs_build:  # give the memory back, the build folder is not needed after a successful build
+        purge_folder(tmpfs_build)
     return True
 
-# Run Main
-init()
-parser = argparse.ArgumentParser(description=HELP_TEXT.format(hl=Style.BRIGHT, chl=Style.RESET_ALL),
-                                 formatter_class=argparse.RawDescriptionHelpFormatter)
-parser.add_argument("--prefix", "-p", default="~/MWTC/", help="Path to the sandbox folder[~/MWTC]")
-parser.add_argument("--gcc", "-g", default="99", help="Version string for preferred GCC[99]")
-parser.add_argument("--binutils", "-b", default="99", help="Version string for preferred Binutils[99]")
-parser.add_argument("--mingw", "-m", default="99", help="Version string for preferred Mingw-w64[99]")
-parser.add_argument("--sjlj", action='store_true', help="Use sjlj exception handling for win32. Default is dw2")
-parser.add_argument("--skip-gmp", action="store_true", default=argparse.SUPPRESS, help="skip building GMP")
-parser.add_argument("--skip-mpfr", action="store_true", default=argparse.SUPPRESS, help="skip building MPFR")
-parser.add_argument("--skip-isl", action="store_true", default=argparse.SUPPRESS, help="skip building ISL")
-parser.add_argument("--skip-mpc", action="store_true", default=argparse.SUPPRESS, help="skip building MPC")
-parser.add_argument("--skip-gcc1", action="store_true", default=argparse.SUPPRESS, help="skip building GCC1")
-raw_args = parser.parse_args()
-args = vars(raw_args)
-WORK_FOLDER = args["prefix"]
-PREFERRED_FOLDER_VERSION["gcc"] = args["gcc"]
-PREFERRED_FILE_VERSION["gcc"] = args["gcc"]
-PREFERRED_FOLDER_VERSION["binutils"] = args["binutils"]
-PREFERRED_FILE_VERSION["binutils"] = args["binutils"]
-PREFERRED_FILE_VERSION["mingw64"] = args["mingw"]
-if args["sjlj"]:
-    USE_SJLJ = True
-else:
-    USE_SJLJ = False
 
-print("Testing GNU Server Mirrors...")
-mirror, latency = select_mirror(GNU_MIRRORS, 1)
-if mirror:
-    GNU_SERVER = mirror
-    print("Selecting mirror ", mirror, " with latency ", latency, "s")
-else:
-    print("Using default ", GNU_SERVER, 1)
+def cli():
+    """
+    Command line entry point: parse the arguments, pick the fastest mirrors and run main()
+    :return: None. Exits with status 1 if the build failed.
+    """
+    global WORK_FOLDER, USE_SJLJ, USE_TMPFS, GNU_SERVER, GCC_SERVER
+    init()
+    parser = argparse.ArgumentParser(description=HELP_TEXT.format(hl=Style.BRIGHT, chl=Style.RESET_ALL),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prefix", "-p", default="~/MWTC/", help="Path to the sandbox folder[~/MWTC]")
+    parser.add_argument("--gcc", "-g", default="99", help="Version string for preferred GCC[99]")
+    parser.add_argument("--binutils", "-b", default="99", help="Version string for preferred Binutils[99]")
+    parser.add_argument("--mingw", "-m", default="99", help="Version string for preferred Mingw-w64[99]")
+    parser.add_argument("--sjlj", action='store_true', help="Use sjlj exception handling for win32. Default is dw2")
+    parser.add_argument("--tmpfs", action="store_true", help="Build in /dev/shm instead of the sandbox when 16GB "
+                                                              "are free there")
+    parser.add_argument("--skip-gmp", action="store_true", default=argparse.SUPPRESS, help="skip building GMP")
+    parser.add_argument("--skip-mpfr", action="store_true", default=argparse.SUPPRESS, help="skip building MPFR")
+    parser.add_argument("--skip-isl", action="store_true", default=argparse.SUPPRESS, help="skip building ISL")
+    parser.add_argument("--skip-mpc", action="store_true", default=argparse.SUPPRESS, help="skip building MPC")
+    parser.add_argument("--skip-gcc1", action="store_true", default=argparse.SUPPRESS, help="skip building GCC1")
+    raw_args = parser.parse_args()
+    args = vars(raw_args)
+    WORK_FOLDER = args["prefix"]
+    PREFERRED_FOLDER_VERSION["gcc"] = args["gcc"]
+    PREFERRED_FILE_VERSION["gcc"] = args["gcc"]
+    PREFERRED_FOLDER_VERSION["binutils"] = args["binutils"]
+    PREFERRED_FILE_VERSION["binutils"] = args["binutils"]
+    PREFERRED_FILE_VERSION["mingw64"] = args["mingw"]
+    if args["sjlj"]:
+        USE_SJLJ = True
+    else:
+        USE_SJLJ = False
+    USE_TMPFS = args["tmpfs"]
+
+    print("Testing GNU and GCC Server Mirrors...")
+    (mirror, latency), (gcc_mirror, gcc_latency) = select_mirrors(GNU_MIRRORS, GCC_MIRRORS)
+    if mirror:
+        GNU_SERVER = mirror
+        print("Selecting mirror ", mirror, " with latency ", latency, "s")
+    else:
+        print("Using default ", GNU_SERVER, 1)
 
-print("Testing GCC Server Mirrors...")
-mirror, latency = select_mirror(GCC_MIRRORS)
-if mirror:
-    GCC_SERVER = mirror
-    print("Selecting mirror ", mirror, " with latency ", latency, "s")
-else:
-    print("Using default ", GCC_SERVER)
+    mirror, latency = gcc_mirror, gcc_latency
+    if mirror:
+        GCC_SERVER = mirror
+        print("Selecting mirror ", mirror, " with latency ", latency, "s")
+    else:
+        print("Using default ", GCC_SERVER)
+
+    print("The sandbox would be: ", WORK_FOLDER)
 
+    ret = main()
+    if ret:
+        print_ok("Everything built OK! Please read the readme file prior using the toolchain.")
+    else:
+        print_error("Something goes wrong. Please check error logs.")
+        sys.exit(1)
+    deinit()
 
-print("The sandbox would be: ", WORK_FOLDER)
 
-ret = main()
-if ret:
-    print_ok()
-    print("Everything built OK! Please read the readme file prior using the toolchain.")
-else:
-    print_error()
-    print("Something goes wrong. Please check error logs.")
-    sys.exit(1)
-deinit()
+if __name__ == "__main__":
+    cli()